@@ -1,27 +1,144 @@
 import asyncio
+import os
+from functools import partial
 
-from asyncpg import create_pool
+from aiogram import Dispatcher
 
-from monya.app import bot, dp
+from monya.app import (
+    create_dispatcher,
+    prune_applied_messages,
+    report_bot_stats,
+    setup_loop,
+)
+from monya.catchup import catch_up
 from monya.db import DBService
-from monya.handlers import add_handlers
-from monya.settings import get_config
+from monya.handlers import add_handlers, notify_rejected
+from monya.journal import Journal, JournaledDBService
+from monya.log import set_bot_context
+from monya.middlewares import UpdateStatsMiddleware
+from monya.offload import LoopLagMonitor, Offloader
+from monya.pool import PoolManager, create_instrumented_pool
+from monya.scheduler import Scheduler
+from monya.settings import BotConfig, ServiceConfig, get_config
+
+
+async def run_bot(
+    dp: Dispatcher,
+    db_service: DBService,
+    config: ServiceConfig,
+    bot_config: BotConfig,
+) -> None:
+    set_bot_context(bot_config.bot_name)
+    await catch_up(dp, db_service, config, bot_config)
+    await dp.start_polling()
 
 
 async def main():
+    setup_loop("monya_")
     config = get_config()
     db_config = config.db_config.dict()
     pool_config = db_config.pop("db_pool_config")
     pool_config["dsn"] = pool_config.pop("db_url")
-    pool = create_pool(**pool_config)
-    db_service = DBService(pool=pool)
+    pool_manager_config = config.db_config.pool_manager_config
+    pool = create_instrumented_pool(
+        wait_threshold=pool_manager_config.pool_wait_threshold,
+        **pool_config,
+    )
+    pool_manager = PoolManager(
+        pool=pool,
+        max_size=pool_config["max_size"],
+        config=pool_manager_config,
+    )
+
+    # All bots share the pool, each has its own service and dispatcher
+    bot_configs = config.telegram_config.get_bots()
+    journal_config = config.journal_config
+    db_services = []
+    dispatchers = []
+    bots_stats = {}
+    for bot_config in bot_configs:
+        stats = UpdateStatsMiddleware()
+        dp = create_dispatcher(bot_config, stats, config.flood_config)
+        if journal_config.journal_enabled:
+            journal_dir = os.path.join(
+                journal_config.journal_dir,
+                str(bot_config.t_bot_id),
+            )
+            db_service = JournaledDBService(
+                pool=pool,
+                t_bot_id=bot_config.t_bot_id,
+                journal=Journal(
+                    journal_config.copy(update={"journal_dir": journal_dir})
+                ),
+                ack_timeout=journal_config.journal_ack_timeout,
+                on_rejected=partial(notify_rejected, dp.bot),
+            )
+        else:
+            db_service = DBService(pool=pool, t_bot_id=bot_config.t_bot_id)
+        db_services.append(db_service)
+        dispatchers.append(dp)
+        bots_stats[bot_config.bot_name] = stats
+
+    # Schedules are stored by internal chat ids, so runs of all bots
+    # are applied by one scheduler through any of the services
+    scheduler = Scheduler(db_services[0], config.scheduler_config)
+    offloader = Offloader(config.offload_config)
+    loop_lag_monitor = LoopLagMonitor(config.offload_config)
+    stats_task = None
+    prune_task = None
+    await pool
     try:
-        add_handlers(dp, db_service, config)
-        await db_service.setup()
-        await dp.start_polling()
+        for dp, db_service, bot_config in zip(
+            dispatchers,
+            db_services,
+            bot_configs,
+        ):
+            add_handlers(dp, db_service, bot_config, scheduler, offloader)
+        for db_service in db_services:
+            await db_service.setup()
+        await pool_manager.setup()
+        await scheduler.setup()
+        await offloader.setup()
+        await loop_lag_monitor.setup()
+        stats_task = asyncio.get_running_loop().create_task(
+            report_bot_stats(
+                bots_stats,
+                config.telegram_config.bot_stats_interval,
+            )
+        )
+        prune_task = asyncio.get_running_loop().create_task(
+            prune_applied_messages(
+                db_services,
+                journal_config.journal_applied_ttl,
+                journal_config.journal_prune_interval,
+            )
+        )
+        await asyncio.gather(
+            *(
+                run_bot(dp, db_service, config, bot_config)
+                for dp, db_service, bot_config in zip(
+                    dispatchers,
+                    db_services,
+                    bot_configs,
+                )
+            )
+        )
     finally:
-        await bot.close()
-        await db_service.cleanup()
+        if stats_task is not None:
+            stats_task.cancel()
+        if prune_task is not None:
+            prune_task.cancel()
+        for dp in dispatchers:
+            dp.stop_polling()
+            await dp.bot.close()
+        await loop_lag_monitor.cleanup()
+        await offloader.cleanup()
+        await scheduler.cleanup()
+        await pool_manager.cleanup()
+        for db_service in db_services:
+            await db_service.cleanup()
+        # Closed once, after all bots that share it have stopped
+        await pool.close()
 
 if __name__ == '__main__':
     asyncio.run(main())
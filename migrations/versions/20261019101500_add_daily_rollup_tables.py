@@ -0,0 +1,117 @@
+"""add_daily_rollup_tables
+
+Revision ID: 3c1f0a8e6b27
+Revises: 86d9276c9767
+Create Date: 2026-10-19 10:15:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import UUID, VARCHAR, DATE, FLOAT, INTEGER
+
+# revision identifiers, used by Alembic.
+revision = '3c1f0a8e6b27'
+down_revision = '86d9276c9767'
+branch_labels = None
+depends_on = None
+
+
+def _totals_columns():
+    return [
+        sa.Column("chat_id", UUID, nullable=False),
+        sa.Column("day", DATE, nullable=False),
+        sa.Column("user_id", UUID, nullable=False),
+        sa.Column("spent", FLOAT, nullable=False, server_default="0"),
+        sa.Column("paid", FLOAT, nullable=False, server_default="0"),
+        sa.Column("n_actions", INTEGER, nullable=False, server_default="0"),
+    ]
+
+
+def _totals_constraints():
+    return [
+        sa.ForeignKeyConstraint(
+            columns=("chat_id",),
+            refcolumns=("chats.chat_id",),
+            ondelete="CASCADE",
+        ),
+        sa.ForeignKeyConstraint(
+            columns=("user_id",),
+            refcolumns=("users.user_id",),
+            ondelete="CASCADE",
+        ),
+    ]
+
+
+def upgrade():
+    # Category of an action: first #tag of the comment or the whole comment
+    op.execute(
+        r"""
+        CREATE FUNCTION action_category(comment VARCHAR)
+        RETURNS VARCHAR
+        LANGUAGE SQL
+        IMMUTABLE
+        AS $$
+            SELECT COALESCE(
+                '#' || lower(substring(comment from '#(\w+)')),
+                lower(btrim(comment))
+            )
+        $$;
+        """
+    )
+
+    op.create_table(
+        "user_daily_totals",
+        *_totals_columns(),
+
+        sa.PrimaryKeyConstraint("chat_id", "day", "user_id"),
+        *_totals_constraints(),
+    )
+    op.create_table(
+        "category_daily_totals",
+        *_totals_columns(),
+        sa.Column("category", VARCHAR(128), nullable=False),
+
+        sa.PrimaryKeyConstraint("chat_id", "day", "user_id", "category"),
+        *_totals_constraints(),
+    )
+
+    # Backfill from existing history
+    op.execute(
+        """
+        INSERT INTO user_daily_totals
+            (chat_id, day, user_id, spent, paid, n_actions)
+        SELECT
+            u.chat_id,
+            a.added_at::DATE,
+            a.user_id,
+            COALESCE(sum(-a.amount) FILTER (WHERE a.amount < 0), 0),
+            COALESCE(sum(a.amount) FILTER (WHERE a.amount > 0), 0),
+            count(*)
+        FROM actions a
+            JOIN users u on u.user_id = a.user_id
+        GROUP BY 1, 2, 3
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO category_daily_totals
+            (chat_id, day, user_id, category, spent, paid, n_actions)
+        SELECT
+            u.chat_id,
+            a.added_at::DATE,
+            a.user_id,
+            action_category(a.comment),
+            COALESCE(sum(-a.amount) FILTER (WHERE a.amount < 0), 0),
+            COALESCE(sum(a.amount) FILTER (WHERE a.amount > 0), 0),
+            count(*)
+        FROM actions a
+            JOIN users u on u.user_id = a.user_id
+        GROUP BY 1, 2, 3, 4
+        """
+    )
+
+
+def downgrade():
+    op.drop_table("category_daily_totals")
+    op.drop_table("user_daily_totals")
+    op.execute("DROP FUNCTION action_category(VARCHAR);")
@@ -0,0 +1,44 @@
+"""add_applied_messages_table
+
+Revision ID: 5e2d9b47c1a0
+Revises: 3c1f0a8e6b27
+Create Date: 2026-10-19 11:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import UUID, TIMESTAMP, BIGINT
+
+# revision identifiers, used by Alembic.
+revision = '5e2d9b47c1a0'
+down_revision = '3c1f0a8e6b27'
+branch_labels = None
+depends_on = None
+
+
+SERVER_NOW = sa.func.now()
+
+
+def upgrade():
+    op.create_table(
+        "applied_messages",
+        sa.Column("chat_id", UUID, nullable=False),
+        sa.Column("t_message_id", BIGINT, nullable=False),
+        sa.Column(
+            "added_at",
+            TIMESTAMP,
+            nullable=False,
+            server_default=SERVER_NOW,
+        ),
+
+        sa.PrimaryKeyConstraint("chat_id", "t_message_id"),
+        sa.ForeignKeyConstraint(
+            columns=("chat_id",),
+            refcolumns=("chats.chat_id",),
+            ondelete="CASCADE",
+        ),
+    )
+
+
+def downgrade():
+    op.drop_table("applied_messages")
@@ -0,0 +1,96 @@
+"""add_schedules_table
+
+Revision ID: a4f7c2d913e8
+Revises: 5e2d9b47c1a0
+Create Date: 2026-10-19 12:45:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import (
+    UUID,
+    VARCHAR,
+    TIMESTAMP,
+    FLOAT,
+    INTEGER,
+)
+
+# revision identifiers, used by Alembic.
+revision = 'a4f7c2d913e8'
+down_revision = '5e2d9b47c1a0'
+branch_labels = None
+depends_on = None
+
+
+SERVER_NOW = sa.func.now()
+SERVER_UUID = sa.text("gen_random_uuid()")
+
+
+def upgrade():
+    op.create_table(
+        "schedules",
+        sa.Column(
+            "schedule_id",
+            UUID,
+            nullable=False,
+            server_default=SERVER_UUID,
+        ),
+        sa.Column("chat_id", UUID, nullable=False),
+        sa.Column("user_id", UUID, nullable=False),
+        sa.Column("amount", FLOAT, nullable=False),
+        sa.Column("comment", VARCHAR(128), nullable=False),
+        sa.Column("period", VARCHAR(16), nullable=False),
+        sa.Column(
+            "first_run_at",
+            TIMESTAMP,
+            nullable=False,
+            server_default=SERVER_NOW,
+        ),
+        sa.Column("n_runs", INTEGER, nullable=False, server_default="0"),
+        sa.Column(
+            "next_run_at",
+            TIMESTAMP,
+            nullable=False,
+            server_default=SERVER_NOW,
+        ),
+        sa.Column(
+            "added_at",
+            TIMESTAMP,
+            nullable=False,
+            server_default=SERVER_NOW,
+        ),
+
+        sa.PrimaryKeyConstraint("schedule_id"),
+        sa.ForeignKeyConstraint(
+            columns=("chat_id",),
+            refcolumns=("chats.chat_id",),
+            ondelete="CASCADE",
+        ),
+        sa.ForeignKeyConstraint(
+            columns=("user_id",),
+            refcolumns=("users.user_id",),
+            ondelete="CASCADE",
+        ),
+        sa.CheckConstraint(
+            "period IN ('day', 'week', 'month')",
+            name="ck_schedules_period",
+        ),
+    )
+    op.create_index(
+        op.f("ix_schedules_next_run_at"),
+        "schedules",
+        ["next_run_at"],
+        unique=False,
+    )
+    op.create_index(
+        op.f("ix_schedules_chat_id"),
+        "schedules",
+        ["chat_id"],
+        unique=False,
+    )
+
+
+def downgrade():
+    op.drop_index(op.f("ix_schedules_chat_id"), table_name="schedules")
+    op.drop_index(op.f("ix_schedules_next_run_at"), table_name="schedules")
+    op.drop_table("schedules")
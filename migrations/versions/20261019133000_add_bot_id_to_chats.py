@@ -0,0 +1,58 @@
+"""add_bot_id_to_chats
+
+Revision ID: 9b3e6d1f0c54
+Revises: a4f7c2d913e8
+Create Date: 2026-10-19 13:30:00.000000
+
+"""
+import os
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import BIGINT
+
+# revision identifiers, used by Alembic.
+revision = '9b3e6d1f0c54'
+down_revision = 'a4f7c2d913e8'
+branch_labels = None
+depends_on = None
+
+
+def get_main_bot_id():
+    """Existing chats belong to the bot from BOT_TOKEN"""
+    bot_token = os.getenv("BOT_TOKEN")
+    if not bot_token:
+        return None
+    return int(bot_token.split(":", 1)[0])
+
+
+def upgrade():
+    op.add_column("chats", sa.Column("t_bot_id", BIGINT, nullable=True))
+
+    main_bot_id = get_main_bot_id()
+    if main_bot_id is not None:
+        op.execute(
+            sa.text("UPDATE chats SET t_bot_id = :t_bot_id")
+            .bindparams(t_bot_id=main_bot_id)
+        )
+    # Fails if there are chats, but BOT_TOKEN is not set
+    op.alter_column("chats", "t_bot_id", nullable=False)
+
+    op.drop_index(op.f("ix_chats_t_chat_id"), table_name="chats")
+    op.create_index(
+        op.f("ix_chats_t_bot_id_t_chat_id"),
+        "chats",
+        ["t_bot_id", "t_chat_id"],
+        unique=True,
+    )
+
+
+def downgrade():
+    op.drop_index(op.f("ix_chats_t_bot_id_t_chat_id"), table_name="chats")
+    op.create_index(
+        op.f("ix_chats_t_chat_id"),
+        "chats",
+        ["t_chat_id"],
+        unique=True,
+    )
+    op.drop_column("chats", "t_bot_id")
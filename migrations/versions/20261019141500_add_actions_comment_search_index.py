@@ -0,0 +1,64 @@
+"""add_actions_comment_search_index
+
+Revision ID: 2d8a5f3c7e91
+Revises: 9b3e6d1f0c54
+Create Date: 2026-10-19 14:15:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import UUID
+
+# revision identifiers, used by Alembic.
+revision = '2d8a5f3c7e91'
+down_revision = '9b3e6d1f0c54'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+    # Allows UUID chat_id in the same GIN index as comment trigrams
+    op.execute("CREATE EXTENSION IF NOT EXISTS btree_gin;")
+
+    op.add_column("actions", sa.Column("chat_id", UUID, nullable=True))
+    op.execute(
+        """
+        UPDATE actions a
+        SET chat_id = u.chat_id
+        FROM users u
+        WHERE u.user_id = a.user_id
+        """
+    )
+    op.alter_column("actions", "chat_id", nullable=False)
+    op.create_foreign_key(
+        op.f("fk_actions_chat_id_chats"),
+        "actions",
+        "chats",
+        ["chat_id"],
+        ["chat_id"],
+        ondelete="CASCADE",
+    )
+    op.create_index(
+        op.f("ix_actions_chat_id_comment_trgm"),
+        "actions",
+        ["chat_id", "comment"],
+        unique=False,
+        postgresql_using="gin",
+        postgresql_ops={"comment": "gin_trgm_ops"},
+    )
+
+
+def downgrade():
+    op.drop_index(
+        op.f("ix_actions_chat_id_comment_trgm"),
+        table_name="actions",
+    )
+    op.drop_constraint(
+        op.f("fk_actions_chat_id_chats"),
+        "actions",
+        type_="foreignkey",
+    )
+    op.drop_column("actions", "chat_id")
+    op.execute("DROP EXTENSION IF EXISTS btree_gin;")
+    op.execute("DROP EXTENSION IF EXISTS pg_trgm;")
@@ -0,0 +1,30 @@
+"""add_applied_messages_added_at_index
+
+Revision ID: 6f1c8e2a4b73
+Revises: 2d8a5f3c7e91
+Create Date: 2026-10-19 15:00:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '6f1c8e2a4b73'
+down_revision = '2d8a5f3c7e91'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        op.f("ix_applied_messages_added_at"),
+        "applied_messages",
+        ["added_at"],
+        unique=False,
+    )
+
+
+def downgrade():
+    op.drop_index(
+        op.f("ix_applied_messages_added_at"),
+        table_name="applied_messages",
+    )
@@ -9,14 +9,27 @@ from asyncpg import create_pool
 from .db import DBService
 from .handlers import add_handlers
 from .log import setup_logging, app_logger
-from .settings import get_config
+from .middlewares import (
+    FloodControlMiddleware,
+    TgContextMiddleware,
+    UpdateStatsMiddleware,
+)
+from .settings import BotConfig, FloodConfig, get_config
 import typing as tp
 
 
-def setup_asyncio(thread_name_prefix: str) -> None:
+def setup_asyncio() -> None:
     uvloop.install()
 
-    loop = asyncio.get_event_loop()
+
+def setup_loop(thread_name_prefix: str) -> None:
+    """
+    Configure the running loop.
+
+    Must be called from the loop that runs the bots: `asyncio.run`
+    creates a new loop, so loop settings made at import are lost.
+    """
+    loop = asyncio.get_running_loop()
 
     executor = ThreadPoolExecutor(thread_name_prefix=thread_name_prefix)
     loop.set_default_executor(executor)
@@ -28,13 +41,70 @@ def setup_asyncio(thread_name_prefix: str) -> None:
     loop.set_exception_handler(handler)
 
 
-setup_asyncio("monya_")
+setup_asyncio()
 config = get_config()
 setup_logging(config)
-bot = Bot(token=config.telegram_config.bot_token)
 
-dp = Dispatcher(bot)
-dp.middleware.setup(LoggingMiddleware(logger=app_logger))
+
+def create_dispatcher(
+    bot_config: BotConfig,
+    stats: UpdateStatsMiddleware,
+    flood_config: FloodConfig,
+) -> Dispatcher:
+    bot = Bot(token=bot_config.bot_token)
+    dp = Dispatcher(bot)
+    dp.middleware.setup(TgContextMiddleware())
+    dp.middleware.setup(stats)
+    if flood_config.flood_enabled:
+        dp.middleware.setup(FloodControlMiddleware(flood_config, stats))
+    dp.middleware.setup(LoggingMiddleware(logger=app_logger))
+    return dp
+
+
+async def report_bot_stats(
+    bots_stats: tp.Dict[str, UpdateStatsMiddleware],
+    interval: float,
+) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        for bot_name, stats in bots_stats.items():
+            window_stats = stats.get_stats()
+            stats.reset_window()
+            app_logger.info(
+                "Bot %s: %s updates %s, %s dropped %s, "
+                "avg %.0f ms, max %.0f ms",
+                bot_name,
+                window_stats["n_updates"],
+                window_stats["n_updates_by_type"],
+                window_stats["n_dropped"],
+                window_stats["n_dropped_by_reason"],
+                window_stats["handle_time_avg"] * 1000,
+                window_stats["handle_time_max"] * 1000,
+            )
+
+
+async def prune_applied_messages(
+    db_services: tp.List[DBService],
+    max_age: float,
+    interval: float,
+) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        for db_service in db_services:
+            try:
+                n_pruned = await db_service.prune_applied_messages(max_age)
+            except Exception:  # pylint: disable=broad-except
+                app_logger.exception(
+                    "Failed to prune applied messages of bot %s",
+                    db_service.t_bot_id,
+                )
+                continue
+            app_logger.info(
+                "Pruned %s applied messages of bot %s",
+                n_pruned,
+                db_service.t_bot_id,
+            )
+
 
 # loop = asyncio.new_event_loop()
 # asyncio.set_event_loop(loop)
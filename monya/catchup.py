@@ -0,0 +1,264 @@
+import asyncio
+import re
+import typing as tp
+from collections import defaultdict
+
+from aiogram import Bot, Dispatcher
+from aiogram import types as tt
+from aiogram.utils.exceptions import RetryAfter
+
+from .db import DBService
+from .handlers import (
+    make_not_written_reply,
+    make_spend_pay_regexp,
+    parse_spend_pay_batch,
+    reply_spend_pay_batch,
+    write_spend_pay_batch,
+)
+from .journal import TRANSIENT_ERRORS
+from .log import app_logger, set_tg_context
+from .settings import BotConfig, CatchUpConfig, ServiceConfig
+
+MAX_UPDATES_LIMIT = 100
+
+
+def get_update_chat_id(update: tt.Update) -> tp.Optional[int]:
+    if update.message:
+        return update.message.chat.id
+    if update.callback_query and update.callback_query.message:
+        return update.callback_query.message.chat.id
+    return None
+
+
+async def process_update(dp: Dispatcher, update: tt.Update) -> None:
+    try:
+        await dp.process_update(update)
+    except Exception:  # pylint: disable=broad-except
+        app_logger.exception("Failed to process update %s", update.update_id)
+
+
+async def process_writes(
+    messages: tp.List[tt.Message],
+    db_service: DBService,
+    config: CatchUpConfig,
+) -> None:
+    """
+    Write messages to DB, retrying while DB is unavailable.
+
+    Updates are confirmed to Telegram by the next `get_updates`,
+    so waiting here instead of dropping the batch loses nothing.
+    Replies are sent once, after the write. If all
+    `catchup_max_attempts` attempts fail, senders are asked
+    to repeat their messages.
+    """
+    if not messages:
+        return
+    set_tg_context(messages[0].chat.id, None, messages[0].message_id)
+    try:
+        parsed = await parse_spend_pay_batch(messages, db_service)
+        if not parsed:
+            return
+        for attempt in range(1, config.catchup_max_attempts + 1):
+            try:
+                errors = await write_spend_pay_batch(parsed, db_service)
+                break
+            except TRANSIENT_ERRORS:
+                app_logger.warning(
+                    "Failed to write %s messages (attempt %s of %s)",
+                    len(parsed),
+                    attempt,
+                    config.catchup_max_attempts,
+                    exc_info=True,
+                )
+                if attempt < config.catchup_max_attempts:
+                    await asyncio.sleep(config.catchup_retry_interval)
+        else:
+            app_logger.error("Dropped %s write messages", len(parsed))
+            for event, _ in parsed:
+                await event.reply(make_not_written_reply())
+            return
+        await reply_spend_pay_batch(parsed, errors, db_service)
+    except Exception:  # pylint: disable=broad-except
+        app_logger.exception(
+            "Failed to process %s write messages",
+            len(messages),
+        )
+
+
+async def process_chat_updates(
+    dp: Dispatcher,
+    db_service: DBService,
+    spend_pay_re: tp.Pattern,
+    updates: tp.List[tt.Update],
+    config: CatchUpConfig,
+) -> None:
+    """
+    Process updates of one chat in order.
+
+    Consecutive pay/spend messages are written to DB as one batch.
+    """
+    writes: tp.List[tt.Message] = []
+    for update in updates:
+        message = update.message
+        if message and message.text and spend_pay_re.match(message.text):
+            writes.append(message)
+            continue
+        await process_writes(writes, db_service, config)
+        writes = []
+        await process_update(dp, update)
+    await process_writes(writes, db_service, config)
+
+
+async def process_backlog(
+    dp: Dispatcher,
+    db_service: DBService,
+    config: ServiceConfig,
+    bot_config: BotConfig,
+    updates: tp.List[tt.Update],
+) -> None:
+    """Process chats in parallel, updates of each chat - sequentially"""
+    spend_pay_re = re.compile(
+        make_spend_pay_regexp(bot_config.bot_name),
+        flags=re.IGNORECASE | re.MULTILINE,
+    )
+    chats_updates = defaultdict(list)
+    for update in updates:
+        chats_updates[get_update_chat_id(update)].append(update)
+
+    semaphore = asyncio.Semaphore(config.catchup_config.catchup_concurrency)
+
+    async def process_chat(chat_updates: tp.List[tt.Update]) -> None:
+        async with semaphore:
+            await process_chat_updates(
+                dp,
+                db_service,
+                spend_pay_re,
+                chat_updates,
+                config.catchup_config,
+            )
+
+    await asyncio.gather(*(process_chat(u) for u in chats_updates.values()))
+
+
+def get_retry_delay(error: Exception, config: CatchUpConfig) -> float:
+    if isinstance(error, RetryAfter):
+        return max(config.catchup_retry_interval, error.timeout)
+    return config.catchup_retry_interval
+
+
+async def get_updates(
+    bot: Bot,
+    offset: tp.Optional[int],
+    config: CatchUpConfig,
+) -> tp.Optional[tp.List[tt.Update]]:
+    """Returns None if all `catchup_max_attempts` attempts failed"""
+    for attempt in range(1, config.catchup_max_attempts + 1):
+        try:
+            return await bot.get_updates(
+                offset=offset,
+                limit=MAX_UPDATES_LIMIT,
+                timeout=0,
+            )
+        except Exception as e:  # pylint: disable=broad-except
+            delay = get_retry_delay(e, config)
+            app_logger.warning(
+                "Failed to get updates (attempt %s of %s): %r",
+                attempt,
+                config.catchup_max_attempts,
+                e,
+            )
+            if attempt < config.catchup_max_attempts:
+                await asyncio.sleep(delay)
+    return None
+
+
+async def confirm_updates(
+    bot: Bot,
+    offset: int,
+    config: CatchUpConfig,
+) -> None:
+    """
+    Confirm updates before `offset`, retrying until Telegram answers.
+
+    Polling would fetch unconfirmed updates again and repeat
+    their commands, only writes are idempotent.
+    """
+    while True:
+        try:
+            await bot.get_updates(offset=offset, limit=1, timeout=0)
+            return
+        except Exception as e:  # pylint: disable=broad-except
+            delay = get_retry_delay(e, config)
+            app_logger.warning("Failed to confirm updates: %r", e)
+            await asyncio.sleep(delay)
+
+
+async def catch_up(
+    dp: Dispatcher,
+    db_service: DBService,
+    config: ServiceConfig,
+    bot_config: BotConfig,
+) -> None:
+    """
+    Drain updates accumulated during downtime before normal polling.
+
+    Does nothing if the backlog is smaller than `catchup_min_backlog`.
+    Returns when Telegram has no more pending updates, all fetched
+    updates are confirmed by then. If Telegram keeps failing,
+    confirms processed updates and leaves the rest to normal polling.
+    """
+    catchup_config = config.catchup_config
+    if not catchup_config.catchup_enabled:
+        return
+
+    bot = dp.bot
+    Dispatcher.set_current(dp)
+    Bot.set_current(bot)
+    try:
+        await dp.reset_webhook(check=False)
+        webhook_info = await bot.get_webhook_info()
+    except Exception:  # pylint: disable=broad-except
+        app_logger.exception("Failed to check backlog, skipping catch-up")
+        return
+    backlog = webhook_info.pending_update_count or 0
+    if backlog < catchup_config.catchup_min_backlog:
+        return
+    app_logger.info("Catching up with %s pending updates", backlog)
+
+    loop = asyncio.get_running_loop()
+    started_at = loop.time()
+    offset = None
+    n_processed = 0
+    while True:
+        updates = await get_updates(bot, offset, catchup_config)
+        if updates is None:
+            if offset is not None:
+                await confirm_updates(bot, offset, catchup_config)
+            app_logger.warning(
+                "Catch-up interrupted after %s updates, "
+                "switching to polling",
+                n_processed,
+            )
+            return
+        if not updates:
+            break
+        offset = updates[-1].update_id + 1
+        await process_backlog(dp, db_service, config, bot_config, updates)
+
+        n_processed += len(updates)
+        elapsed = max(loop.time() - started_at, 1e-6)
+        app_logger.info(
+            "Catch-up: %s of ~%s updates processed, %.1f updates/s",
+            n_processed,
+            backlog,
+            n_processed / elapsed,
+        )
+
+    elapsed = max(loop.time() - started_at, 1e-6)
+    app_logger.info(
+        "Caught up: %s updates in %.1f s (%.1f updates/s), "
+        "switching to polling",
+        n_processed,
+        elapsed,
+        n_processed / elapsed,
+    )
@@ -1,6 +1,7 @@
+from datetime import date, datetime
 from uuid import UUID
 import typing as tp
-from asyncpg import Pool, UniqueViolationError
+from asyncpg import Connection, Pool, UniqueViolationError
 from pydantic import BaseModel
 
 from monya.log import app_logger
@@ -19,41 +20,62 @@ class ChatAlreadyExistsError(Exception):
 
 
 class DBService(BaseModel):
+    """
+    Queries of one bot.
+
+    Chats are isolated by `t_bot_id`, so several bots (one service
+    per bot) can share the same pool and tables.
+    """
+
     pool: Pool
+    t_bot_id: int
 
     class Config:
         arbitrary_types_allowed = True
 
     async def setup(self) -> None:
         await self.pool
-        app_logger.info("Db service initialized")
+        app_logger.info("Db service of bot %s initialized", self.t_bot_id)
 
     async def cleanup(self) -> None:
-        await self.pool.close()
-        app_logger.info("Db service shutdown")
+        """The pool is not closed: it may be shared with other services"""
+        app_logger.info("Db service of bot %s shutdown", self.t_bot_id)
 
     async def ping(self) -> bool:
         return await self.pool.fetchval("SELECT TRUE")
 
-    async def _get_user_id(self, t_chat_id: int, name: str) -> tp.Optional[UUID]:
+    async def _get_user_id(
+        self,
+        t_chat_id: int,
+        name: str,
+        conn: tp.Optional[Connection] = None,
+    ) -> tp.Optional[UUID]:
         query = """
             SELECT user_id
             FROM users u
                 JOIN chats c on u.chat_id = c.chat_id
-            WHERE c.t_chat_id = $1::INTEGER AND u.name = $2::VARCHAR
+            WHERE
+                c.t_bot_id = $3::BIGINT
+                AND c.t_chat_id = $1::INTEGER
+                AND u.name = $2::VARCHAR
         """
-        user_id = await self.pool.fetchval(query, t_chat_id, name)
+        user_id = await (conn or self.pool).fetchval(
+            query,
+            t_chat_id,
+            name,
+            self.t_bot_id,
+        )
         return user_id
 
     async def add_chat(self, t_chat_id: int) -> None:
         query = """
             INSERT INTO chats
-                (t_chat_id)
+                (t_chat_id, t_bot_id)
             VALUES
-                ($1::INTEGER)
+                ($1::INTEGER, $2::BIGINT)
         """
         try:
-            await self.pool.execute(query, t_chat_id)
+            await self.pool.execute(query, t_chat_id, self.t_bot_id)
         except UniqueViolationError as e:
             raise ChatAlreadyExistsError from e
 
@@ -64,10 +86,12 @@ class DBService(BaseModel):
                 SELECT user_id
                 FROM users u
                     JOIN chats c on u.chat_id = c.chat_id
-                WHERE c.t_chat_id = $1::INTEGER
+                WHERE c.t_bot_id = $2::BIGINT AND c.t_chat_id = $1::INTEGER
             )
         """
-        await self.pool.execute(query, t_chat_id)
+        async with self.pool.acquire() as conn, conn.transaction():
+            await conn.execute(query, t_chat_id, self.t_bot_id)
+            await self._delete_totals(conn, t_chat_id, self.t_bot_id)
 
     async def add_user(self, t_chat_id: int, name: str) -> None:
         user_id = await self._get_user_id(t_chat_id, name)
@@ -80,11 +104,20 @@ class DBService(BaseModel):
                 (chat_id, name)
             VALUES
                 (
-                    (SELECT chat_id FROM chats WHERE t_chat_id = $1::INTEGER),
+                    (
+                        SELECT chat_id
+                        FROM chats
+                        WHERE t_bot_id = $3::BIGINT AND t_chat_id = $1::INTEGER
+                    ),
                     $2::VARCHAR
                 )
         """
-        await self.pool.execute(query_insert, t_chat_id, name)
+        await self.pool.execute(
+            query_insert,
+            t_chat_id,
+            name,
+            self.t_bot_id,
+        )
 
     async def delete_user(self, t_chat_id: int, name: str):
         user_id = await self._get_user_id(t_chat_id, name)
@@ -103,9 +136,9 @@ class DBService(BaseModel):
             SELECT name
             FROM users u
                 JOIN chats c on u.chat_id = c.chat_id
-            WHERE c.t_chat_id = $1::INTEGER
+            WHERE c.t_bot_id = $2::BIGINT AND c.t_chat_id = $1::INTEGER
         """
-        rows = await self.pool.fetch(query, t_chat_id)
+        rows = await self.pool.fetch(query, t_chat_id, self.t_bot_id)
         return [row["name"] for row in rows]
 
     async def add_operation(
@@ -115,28 +148,217 @@ class DBService(BaseModel):
         amount: float,
         comment: str,
     ) -> None:
-        user_id = await self._get_user_id(t_chat_id, name)
-        if user_id is None:
-            raise UserNotExistsError
+        await self.add_operations(t_chat_id, [(name, amount, comment)])
 
-        query = """
-            INSERT INTO actions
-                (user_id, amount, comment)
-            VALUES
-                (
-                    $1::UUID,
-                    $2::FLOAT,
-                    $3::VARCHAR
+    async def add_operations(
+        self,
+        t_chat_id: int,
+        operations: tp.Sequence[tp.Tuple[str, float, str]],
+        t_message_id: tp.Optional[int] = None,
+    ) -> None:
+        """
+        Add all operations in one transaction or none of them.
+
+        Raises `UserNotExistsError` with unknown names as args
+        if any of the names is not in the chat.
+        If `t_message_id` is given, operations of the message
+        that was already applied are skipped.
+        """
+        errors = await self.add_operations_batch(
+            t_chat_id,
+            [(t_message_id, operations)],
+        )
+        if errors[0] is not None:
+            raise errors[0]
+
+    async def add_operations_batch(
+        self,
+        t_chat_id: int,
+        batch: tp.Sequence[
+            tp.Tuple[tp.Optional[int], tp.Sequence[tp.Tuple[str, float, str]]]
+        ],
+    ) -> tp.List[tp.Optional[UserNotExistsError]]:
+        """
+        Add operations of several messages with one INSERT.
+
+        `batch` consists of (t_message_id, operations) pairs.
+        Each message is applied entirely or not at all: messages
+        with unknown names are skipped and `UserNotExistsError`
+        is returned at their position, None is returned for others.
+        Messages that were already applied are skipped silently.
+        """
+        query_users = """
+            SELECT u.name, u.user_id
+            FROM users u
+                JOIN chats c on u.chat_id = c.chat_id
+            WHERE
+                c.t_bot_id = $3::BIGINT
+                AND c.t_chat_id = $1::INTEGER
+                AND u.name = ANY($2::VARCHAR[])
+        """
+        query_messages = """
+            INSERT INTO applied_messages
+                (chat_id, t_message_id)
+            SELECT c.chat_id, m.t_message_id
+            FROM chats c, unnest($2::BIGINT[]) AS m(t_message_id)
+            WHERE c.t_bot_id = $3::BIGINT AND c.t_chat_id = $1::INTEGER
+            ON CONFLICT DO NOTHING
+            RETURNING t_message_id
+        """
+        names = list({
+            name for _, operations in batch for name, _, _ in operations
+        })
+        async with self.pool.acquire() as conn, conn.transaction():
+            rows = await conn.fetch(
+                query_users,
+                t_chat_id,
+                names,
+                self.t_bot_id,
+            )
+            user_ids = {row["name"]: row["user_id"] for row in rows}
+
+            errors: tp.List[tp.Optional[UserNotExistsError]] = []
+            for _, operations in batch:
+                missing = {
+                    name for name, _, _ in operations if name not in user_ids
+                }
+                errors.append(
+                    UserNotExistsError(*sorted(missing)) if missing else None
+                )
+
+            message_ids = [
+                t_message_id
+                for (t_message_id, _), error in zip(batch, errors)
+                if t_message_id is not None and error is None
+            ]
+            new_message_ids = set()
+            if message_ids:
+                rows = await conn.fetch(
+                    query_messages,
+                    t_chat_id,
+                    message_ids,
+                    self.t_bot_id,
                 )
+                new_message_ids = {row["t_message_id"] for row in rows}
+
+            to_insert = []
+            for (t_message_id, operations), error in zip(batch, errors):
+                if error is not None:
+                    continue
+                if t_message_id is not None \
+                        and t_message_id not in new_message_ids:
+                    app_logger.info(
+                        "Message %s is already applied, skipping",
+                        t_message_id,
+                    )
+                    continue
+                to_insert.extend(operations)
+
+            if to_insert:
+                await self._insert_actions(
+                    conn,
+                    [
+                        (user_ids[name], amount, comment)
+                        for name, amount, comment in to_insert
+                    ],
+                )
+
+        return errors
+
+    async def prune_applied_messages(self, max_age: float) -> int:
+        """
+        Forget ids of messages applied more than `max_age` seconds ago.
+
+        Returns the number of removed ids.
+        """
+        query = """
+            DELETE FROM applied_messages a
+            USING chats c
+            WHERE
+                a.chat_id = c.chat_id
+                AND c.t_bot_id = $2::BIGINT
+                AND a.added_at < now() - make_interval(secs => $1::FLOAT)
         """
-        await self.pool.execute(query, user_id, amount, comment)
+        status = await self.pool.execute(query, max_age, self.t_bot_id)
+        return int(status.split()[-1])
+
+    @staticmethod
+    async def _insert_actions(
+        conn: Connection,
+        actions: tp.Sequence[tp.Tuple[UUID, float, str]],
+        added_at: tp.Optional[tp.Sequence[datetime]] = None,
+    ) -> None:
+        # Without `added_at`, clock_timestamp() keeps the order
+        # of operations within a batch.
+        # Daily totals are updated in the same statement.
+        query_insert = """
+            WITH inserted AS (
+                INSERT INTO actions
+                    (chat_id, user_id, amount, comment, added_at)
+                SELECT
+                    u.chat_id,
+                    o.user_id,
+                    o.amount,
+                    o.comment,
+                    COALESCE(o.added_at, clock_timestamp())
+                FROM unnest(
+                    $1::UUID[],
+                    $2::FLOAT[],
+                    $3::VARCHAR[],
+                    $4::TIMESTAMP[]
+                ) WITH ORDINALITY AS o(user_id, amount, comment, added_at, n)
+                    JOIN users u on u.user_id = o.user_id
+                ORDER BY o.n
+                RETURNING chat_id, user_id, amount, comment, added_at
+            ), user_totals AS (
+                INSERT INTO user_daily_totals AS t
+                    (chat_id, day, user_id, spent, paid, n_actions)
+                SELECT
+                    i.chat_id,
+                    i.added_at::DATE,
+                    i.user_id,
+                    COALESCE(sum(-i.amount) FILTER (WHERE i.amount < 0), 0),
+                    COALESCE(sum(i.amount) FILTER (WHERE i.amount > 0), 0),
+                    count(*)
+                FROM inserted i
+                GROUP BY 1, 2, 3
+                ON CONFLICT (chat_id, day, user_id) DO UPDATE SET
+                    spent = t.spent + EXCLUDED.spent,
+                    paid = t.paid + EXCLUDED.paid,
+                    n_actions = t.n_actions + EXCLUDED.n_actions
+            )
+            INSERT INTO category_daily_totals AS t
+                (chat_id, day, user_id, category, spent, paid, n_actions)
+            SELECT
+                i.chat_id,
+                i.added_at::DATE,
+                i.user_id,
+                action_category(i.comment),
+                COALESCE(sum(-i.amount) FILTER (WHERE i.amount < 0), 0),
+                COALESCE(sum(i.amount) FILTER (WHERE i.amount > 0), 0),
+                count(*)
+            FROM inserted i
+            GROUP BY 1, 2, 3, 4
+            ON CONFLICT (chat_id, day, user_id, category) DO UPDATE SET
+                spent = t.spent + EXCLUDED.spent,
+                paid = t.paid + EXCLUDED.paid,
+                n_actions = t.n_actions + EXCLUDED.n_actions
+        """
+        await conn.execute(
+            query_insert,
+            [user_id for user_id, _, _ in actions],
+            [amount for _, amount, _ in actions],
+            [comment for _, _, comment in actions],
+            added_at if added_at is not None else [None] * len(actions),
+        )
 
     async def get_user_operations(
         self,
         t_chat_id: int,
         name: str,
+        conn: tp.Optional[Connection] = None,
     ) -> tp.List[tp.Tuple[float, str]]:
-        user_id = await self._get_user_id(t_chat_id, name)
+        user_id = await self._get_user_id(t_chat_id, name, conn)
         if user_id is None:
             raise UserNotExistsError
         query = """
@@ -145,20 +367,420 @@ class DBService(BaseModel):
             WHERE user_id = $1::UUID
             ORDER BY added_at
         """
-        operations = await self.pool.fetch(query, user_id)
+        operations = await (conn or self.pool).fetch(query, user_id)
         return [(op["amount"], op["comment"]) for op in operations]
 
     async def get_chat_operations(
         self,
         t_chat_id: int,
+        conn: tp.Optional[Connection] = None,
     ) -> tp.List[tp.Tuple[str, float, str]]:
         query = """
             SELECT u.name, amount, comment
             FROM actions a
                 JOIN users u on u.user_id = a.user_id
                 JOIN chats c on c.chat_id = u.chat_id
-            WHERE c.t_chat_id = $1::INTEGER
+            WHERE c.t_bot_id = $2::BIGINT AND c.t_chat_id = $1::INTEGER
             ORDER BY a.added_at
         """
-        operations = await self.pool.fetch(query, t_chat_id)
+        operations = await (conn or self.pool).fetch(
+            query,
+            t_chat_id,
+            self.t_bot_id,
+        )
+        return [(op["name"], op["amount"], op["comment"]) for op in operations]
+
+    async def get_applied_messages(
+        self,
+        t_chat_id: int,
+        t_message_ids: tp.Sequence[int],
+        conn: tp.Optional[Connection] = None,
+    ) -> tp.Set[int]:
+        """Ids of the given messages whose operations are in DB"""
+        query = """
+            SELECT a.t_message_id
+            FROM applied_messages a
+                JOIN chats c on c.chat_id = a.chat_id
+            WHERE
+                c.t_bot_id = $3::BIGINT
+                AND c.t_chat_id = $1::INTEGER
+                AND a.t_message_id = ANY($2::BIGINT[])
+        """
+        rows = await (conn or self.pool).fetch(
+            query,
+            t_chat_id,
+            list(t_message_ids),
+            self.t_bot_id,
+        )
+        return {row["t_message_id"] for row in rows}
+
+    async def get_recent_operations(
+        self,
+        t_chat_id: int,
+        limit: int,
+    ) -> tp.List[tp.Tuple[str, float, str]]:
+        """Last `limit` operations of the chat, newest first"""
+        query = """
+            SELECT u.name, amount, comment
+            FROM actions a
+                JOIN users u on u.user_id = a.user_id
+                JOIN chats c on c.chat_id = u.chat_id
+            WHERE c.t_bot_id = $3::BIGINT AND c.t_chat_id = $1::INTEGER
+            ORDER BY a.added_at DESC
+            LIMIT $2::INTEGER
+        """
+        operations = await self.pool.fetch(
+            query,
+            t_chat_id,
+            limit,
+            self.t_bot_id,
+        )
         return [(op["name"], op["amount"], op["comment"]) for op in operations]
+
+    async def find_operations(
+        self,
+        t_chat_id: int,
+        text: str,
+        limit: int,
+        offset: int,
+    ) -> tp.Tuple[
+        tp.List[tp.Tuple[datetime, str, float, str]],
+        int,
+        float,
+        float,
+    ]:
+        """
+        Operations whose comment contains words similar to `text`.
+
+        Matches are ranked by trigram word similarity, newest first
+        among equal ones. Returns a page of matches and the number
+        of all matches with their spent and paid totals.
+        """
+        # `<%` is served by the (chat_id, comment) trigram index
+        query = """
+            SELECT
+                a.added_at,
+                u.name,
+                a.amount,
+                a.comment,
+                count(*) OVER () AS n_matches,
+                COALESCE(
+                    sum(-a.amount) FILTER (WHERE a.amount < 0) OVER (), 0
+                ) AS spent,
+                COALESCE(
+                    sum(a.amount) FILTER (WHERE a.amount > 0) OVER (), 0
+                ) AS paid
+            FROM actions a
+                JOIN users u on u.user_id = a.user_id
+                JOIN chats c on c.chat_id = a.chat_id
+            WHERE
+                c.t_bot_id = $5::BIGINT
+                AND c.t_chat_id = $1::INTEGER
+                AND $2::TEXT <% a.comment
+            ORDER BY word_similarity($2::TEXT, a.comment) DESC, a.added_at DESC
+            LIMIT $3::INTEGER
+            OFFSET $4::INTEGER
+        """
+        rows = await self.pool.fetch(
+            query,
+            t_chat_id,
+            text,
+            limit,
+            offset,
+            self.t_bot_id,
+        )
+        if not rows:
+            return [], 0, 0, 0
+        matches = [
+            (row["added_at"], row["name"], row["amount"], row["comment"])
+            for row in rows
+        ]
+        return matches, rows[0]["n_matches"], rows[0]["spent"], rows[0]["paid"]
+
+    @staticmethod
+    async def _delete_totals(
+        conn: Connection,
+        t_chat_id: int,
+        t_bot_id: int,
+    ) -> None:
+        for table in ("user_daily_totals", "category_daily_totals"):
+            query = f"""
+                DELETE FROM {table}
+                WHERE chat_id = (
+                    SELECT chat_id
+                    FROM chats
+                    WHERE t_bot_id = $2::BIGINT AND t_chat_id = $1::INTEGER
+                )
+            """
+            await conn.execute(query, t_chat_id, t_bot_id)
+
+    async def rebuild_totals(self, t_chat_id: int) -> None:
+        """Recalculate daily totals of the chat from its history"""
+        query_users = """
+            INSERT INTO user_daily_totals
+                (chat_id, day, user_id, spent, paid, n_actions)
+            SELECT
+                c.chat_id,
+                a.added_at::DATE,
+                a.user_id,
+                COALESCE(sum(-a.amount) FILTER (WHERE a.amount < 0), 0),
+                COALESCE(sum(a.amount) FILTER (WHERE a.amount > 0), 0),
+                count(*)
+            FROM actions a
+                JOIN users u on u.user_id = a.user_id
+                JOIN chats c on c.chat_id = u.chat_id
+            WHERE c.t_bot_id = $2::BIGINT AND c.t_chat_id = $1::INTEGER
+            GROUP BY 1, 2, 3
+        """
+        query_categories = """
+            INSERT INTO category_daily_totals
+                (chat_id, day, user_id, category, spent, paid, n_actions)
+            SELECT
+                c.chat_id,
+                a.added_at::DATE,
+                a.user_id,
+                action_category(a.comment),
+                COALESCE(sum(-a.amount) FILTER (WHERE a.amount < 0), 0),
+                COALESCE(sum(a.amount) FILTER (WHERE a.amount > 0), 0),
+                count(*)
+            FROM actions a
+                JOIN users u on u.user_id = a.user_id
+                JOIN chats c on c.chat_id = u.chat_id
+            WHERE c.t_bot_id = $2::BIGINT AND c.t_chat_id = $1::INTEGER
+            GROUP BY 1, 2, 3, 4
+        """
+        async with self.pool.acquire() as conn, conn.transaction():
+            await self._delete_totals(conn, t_chat_id, self.t_bot_id)
+            await conn.execute(query_users, t_chat_id, self.t_bot_id)
+            await conn.execute(query_categories, t_chat_id, self.t_bot_id)
+
+    async def get_period_totals(
+        self,
+        t_chat_id: int,
+        period: str,
+        n_periods: int,
+    ) -> tp.List[tp.Tuple[date, str, float, float]]:
+        """
+        Spent and paid amounts per user for last `n_periods` periods.
+
+        `period` is any `date_trunc` field, e.g. 'week' or 'month'.
+        """
+        query = """
+            SELECT
+                date_trunc($2::TEXT, t.day)::DATE AS period,
+                u.name,
+                sum(t.spent) AS spent,
+                sum(t.paid) AS paid
+            FROM user_daily_totals t
+                JOIN users u on u.user_id = t.user_id
+                JOIN chats c on c.chat_id = t.chat_id
+            WHERE
+                c.t_bot_id = $4::BIGINT
+                AND c.t_chat_id = $1::INTEGER
+                AND t.day >= date_trunc($2::TEXT, now())
+                    - ($3::INTEGER - 1) * ('1 ' || $2::TEXT)::INTERVAL
+            GROUP BY 1, 2
+            ORDER BY 1 DESC, 3 DESC
+        """
+        rows = await self.pool.fetch(
+            query,
+            t_chat_id,
+            period,
+            n_periods,
+            self.t_bot_id,
+        )
+        return [
+            (row["period"], row["name"], row["spent"], row["paid"])
+            for row in rows
+        ]
+
+    async def get_top_categories(
+        self,
+        t_chat_id: int,
+        period: str,
+        n_periods: int,
+        limit: int,
+    ) -> tp.List[tp.Tuple[str, float, int]]:
+        query = """
+            SELECT
+                t.category,
+                sum(t.spent) AS spent,
+                sum(t.n_actions) AS n_actions
+            FROM category_daily_totals t
+                JOIN chats c on c.chat_id = t.chat_id
+            WHERE
+                c.t_bot_id = $5::BIGINT
+                AND c.t_chat_id = $1::INTEGER
+                AND t.day >= date_trunc($2::TEXT, now())
+                    - ($3::INTEGER - 1) * ('1 ' || $2::TEXT)::INTERVAL
+                AND t.category <> ''
+            GROUP BY 1
+            HAVING sum(t.spent) > 0
+            ORDER BY 2 DESC
+            LIMIT $4::INTEGER
+        """
+        rows = await self.pool.fetch(
+            query,
+            t_chat_id,
+            period,
+            n_periods,
+            limit,
+            self.t_bot_id,
+        )
+        return [
+            (row["category"], row["spent"], row["n_actions"])
+            for row in rows
+        ]
+
+    async def add_schedule(
+        self,
+        t_chat_id: int,
+        name: str,
+        amount: float,
+        comment: str,
+        period: str,
+    ) -> UUID:
+        """Add recurring operation, the first run is now"""
+        user_id = await self._get_user_id(t_chat_id, name)
+        if user_id is None:
+            raise UserNotExistsError(name)
+
+        query = """
+            INSERT INTO schedules
+                (chat_id, user_id, amount, comment, period)
+            VALUES
+                (
+                    (
+                        SELECT chat_id
+                        FROM chats
+                        WHERE t_bot_id = $6::BIGINT AND t_chat_id = $1::INTEGER
+                    ),
+                    $2::UUID,
+                    $3::FLOAT,
+                    $4::VARCHAR,
+                    $5::VARCHAR
+                )
+            RETURNING schedule_id
+        """
+        return await self.pool.fetchval(
+            query,
+            t_chat_id,
+            user_id,
+            amount,
+            comment,
+            period,
+            self.t_bot_id,
+        )
+
+    async def get_chat_schedules(
+        self,
+        t_chat_id: int,
+    ) -> tp.List[tp.Tuple[UUID, str, float, str, str]]:
+        query = """
+            SELECT s.schedule_id, u.name, s.amount, s.comment, s.period
+            FROM schedules s
+                JOIN users u on u.user_id = s.user_id
+                JOIN chats c on c.chat_id = s.chat_id
+            WHERE c.t_bot_id = $2::BIGINT AND c.t_chat_id = $1::INTEGER
+            ORDER BY s.added_at
+        """
+        rows = await self.pool.fetch(query, t_chat_id, self.t_bot_id)
+        return [
+            (
+                row["schedule_id"],
+                row["name"],
+                row["amount"],
+                row["comment"],
+                row["period"],
+            )
+            for row in rows
+        ]
+
+    async def delete_schedule(self, schedule_id: UUID) -> None:
+        query = """
+            DELETE FROM schedules
+            WHERE schedule_id = $1::UUID
+        """
+        await self.pool.execute(query, schedule_id)
+
+    async def get_upcoming_schedules(
+        self,
+        horizon: float,
+        limit: int,
+    ) -> tp.List[tp.Tuple[UUID, int, float]]:
+        """
+        Schedules to run in `horizon` seconds, missed ones included.
+
+        Returns (schedule_id, n_runs, seconds until the run) tuples,
+        the earliest first.
+        """
+        query = """
+            SELECT
+                schedule_id,
+                n_runs,
+                EXTRACT(EPOCH FROM next_run_at - now()) AS delay
+            FROM schedules
+            WHERE next_run_at < now() + $1::FLOAT * INTERVAL '1 second'
+            ORDER BY next_run_at
+            LIMIT $2::INTEGER
+        """
+        rows = await self.pool.fetch(query, horizon, limit)
+        return [
+            (row["schedule_id"], row["n_runs"], float(row["delay"]))
+            for row in rows
+        ]
+
+    async def run_schedules(
+        self,
+        runs: tp.Sequence[tp.Tuple[UUID, int]],
+    ) -> tp.List[tp.Tuple[UUID, int, float]]:
+        """
+        Add operations of due schedules and move them to the next run.
+
+        `runs` are (schedule_id, n_runs) pairs. A schedule is run only
+        if it is due and its `n_runs` is still the same, so a run
+        can't be applied twice. Operations are added at the time
+        the run was scheduled for, so runs recovered after downtime
+        get into the right day. Returns new (schedule_id, n_runs,
+        seconds until the next run) of the schedules that were run.
+        """
+        query = """
+            UPDATE schedules s
+            SET
+                n_runs = s.n_runs + 1,
+                next_run_at = s.first_run_at
+                    + (s.n_runs + 1) * ('1 ' || s.period)::INTERVAL
+            FROM unnest($1::UUID[], $2::INTEGER[]) AS r(schedule_id, n_runs)
+            WHERE
+                s.schedule_id = r.schedule_id
+                AND s.n_runs = r.n_runs
+                AND s.next_run_at <= now()
+            RETURNING
+                s.schedule_id,
+                s.n_runs,
+                EXTRACT(EPOCH FROM s.next_run_at - now()) AS delay,
+                s.first_run_at
+                    + r.n_runs * ('1 ' || s.period)::INTERVAL AS run_at,
+                s.user_id,
+                s.amount,
+                s.comment
+        """
+        async with self.pool.acquire() as conn, conn.transaction():
+            rows = await conn.fetch(
+                query,
+                [schedule_id for schedule_id, _ in runs],
+                [n_runs for _, n_runs in runs],
+            )
+            if rows:
+                await self._insert_actions(
+                    conn,
+                    [
+                        (row["user_id"], row["amount"], row["comment"])
+                        for row in rows
+                    ],
+                    [row["run_at"] for row in rows],
+                )
+        return [
+            (row["schedule_id"], row["n_runs"], float(row["delay"]))
+            for row in rows
+        ]
@@ -1,9 +1,11 @@
 import re
-import traceback
 from collections import defaultdict
+from datetime import date, datetime
 from functools import partial
+from itertools import groupby
+from uuid import UUID
 
-from aiogram import types as tt, Dispatcher
+from aiogram import types as tt, Bot, Dispatcher
 from aiogram.utils.callback_data import CallbackData
 
 from monya.db import DBService, ChatAlreadyExistsError, UserAlreadyExistsError, \
@@ -11,12 +13,24 @@ from monya.db import DBService, ChatAlreadyExistsError, UserAlreadyExistsError,
 from monya.log import app_logger
 import typing as tp
 
-from monya.settings import ServiceConfig
+from monya.offload import Offloader
+from monya.router import MessageRouter
+from monya.scheduler import Scheduler
+from monya.settings import BotConfig
+from monya.suggest import AMOUNT_PATTERN, SuggestIndex, make_inline_entries
 
 CHAT = "__chat__"
 
 user_cb = CallbackData("user", "cb_type", "name")
 status_cb = CallbackData("status", "variant")
+find_cb = CallbackData("find", "page")
+
+# One index per bot, the same Telegram chat may be served by several bots
+suggest_indexes: tp.DefaultDict[int, SuggestIndex] = defaultdict(SuggestIndex)
+
+
+def get_suggest_index(db_service: DBService) -> SuggestIndex:
+    return suggest_indexes[db_service.t_bot_id]
 
 
 def make_op_users_kb(
@@ -59,6 +73,11 @@ def make_chat_and_users_kb(
 
 
 async def handle(handler, db_service, event: tt.Message):
+    if event.from_user:
+        get_suggest_index(db_service).remember_user_chat(
+            event.from_user.id,
+            event.chat.id,
+        )
     try:
         await db_service.add_chat(event.chat.id)
     except ChatAlreadyExistsError:
@@ -66,10 +85,22 @@ async def handle(handler, db_service, event: tt.Message):
     try:
         await handler(event, db_service)
     except Exception:
-        app_logger.error(traceback.format_exc())
+        app_logger.exception("Failed to handle message")
         raise
 
 
+async def handle_routed(
+    router: MessageRouter,
+    db_service: DBService,
+    event: tt.Message,
+):
+    route = router.route(event)
+    if route is None:
+        return
+    handler, kwargs = route
+    await handle(partial(handler, **kwargs), db_service, event)
+
+
 async def handle_cb(
     handler,
     db_service,
@@ -79,7 +110,15 @@ async def handle_cb(
     try:
         await handler(query, callback_data, db_service)
     except Exception:
-        app_logger.error(traceback.format_exc())
+        app_logger.exception("Failed to handle callback query")
+        raise
+
+
+async def handle_inline(handler, db_service, query: tt.InlineQuery):
+    try:
+        await handler(query, db_service)
+    except Exception:
+        app_logger.exception("Failed to handle inline query")
         raise
 
 
@@ -103,16 +142,41 @@ async def help_h(event: tt.Message, db_service: DBService) -> None:
 /users - получить список текущих участников
 /pay - записать оплату
 /spend - записать трату
+Несколько операций можно записать одним сообщением - по одной на строку:
+@бот pay Имя сумма комментарий
+spend Имя сумма комментарий
+Если начать набирать '@бот pay' или '@бот spend',
+я подскажу имена, суммы и комментарии
 /history - показать историю операций и баланс
 /status - показать статус
+/report week|month - показать траты по неделям или месяцам
+/every day|week|month pay|spend Имя сумма комментарий - записывать регулярно
+/every - показать регулярные операции
+/find текст - найти операции по комментарию
         """
     )
     await event.reply(reply)
 
 
-async def reset_h(event: tt.Message, db_service: DBService) -> None:
-    expected = "/reset Подтверждаю"
-    if event.text != expected:
+NAME_RE = re.compile(r"\w+")
+
+
+def parse_args(args: str) -> tp.Dict[str, tp.Any]:
+    return {"args": args.strip()}
+
+
+def parse_name(args: str) -> tp.Dict[str, tp.Any]:
+    name = args.strip()
+    return {"name": name if NAME_RE.fullmatch(name) else None}
+
+
+async def reset_h(
+    event: tt.Message,
+    db_service: DBService,
+    args: str,
+) -> None:
+    if args != "Подтверждаю":
+        expected = "/reset Подтверждаю"
         reply = f"Напишите '{expected}', если точно хотите все сбросить"
     else:
         await db_service.reset(event.chat.id)
@@ -120,32 +184,44 @@ async def reset_h(event: tt.Message, db_service: DBService) -> None:
     await event.reply(reply)
 
 
-async def add_user_h(event: tt.Message, db_service: DBService) -> None:
-    if not re.match(r"^/add\s+\w+\s*$", event.text):
+async def add_user_h(
+    event: tt.Message,
+    db_service: DBService,
+    name: tp.Optional[str],
+) -> None:
+    if name is None:
         reply = "Что-то не то: нужно писать '/add Имя'"
     else:
-        name = event.text.split()[1].strip()
         try:
             await db_service.add_user(event.chat.id, name)
         except UserAlreadyExistsError:
             reply = f"Ошибка: {name} уже есть - двоих взять не можем :("
         else:
             reply = f"Готово: {name} теперь с нами!"
+            chat = get_suggest_index(db_service).get_loaded(event.chat.id)
+            if chat is not None:
+                chat.add_name(name)
 
     await event.reply(reply)
 
 
-async def delete_user_h(event: tt.Message, db_service: DBService) -> None:
-    if not re.match(r"^/delete\s+\w+\s*$", event.text):
+async def delete_user_h(
+    event: tt.Message,
+    db_service: DBService,
+    name: tp.Optional[str],
+) -> None:
+    if name is None:
         reply = "Что-то не то - нужно писать '/delete Имя'"
     else:
-        name = event.text.split()[1].strip()
         try:
             await db_service.delete_user(event.chat.id, name)
         except UserNotExistsError:
             reply = f"Ошибка: {name} отсутствует в списке"
         else:
             reply = f"Готово: {name} больше не с нами"
+            chat = get_suggest_index(db_service).get_loaded(event.chat.id)
+            if chat is not None:
+                chat.remove_name(name)
 
     await event.reply(reply)
 
@@ -177,18 +253,185 @@ async def spend_h(event: tt.Message, db_service: DBService) -> None:
     await event.reply(reply, reply_markup=keyboard)
 
 
-async def spend_pay_msg_h(event: tt.Message, db_service: DBService) -> None:
-    _, cmd, name, amount, *comments = event.text.split(maxsplit=4)
-    comment = " ".join(comments)
-    amount = float(amount.replace(",", "."))
-    assert cmd in ("pay", "spend")
-    if cmd == "spend":
-        amount = -amount
-    await db_service.add_operation(event.chat.id, name, amount, comment)
-    reply = f"Записано: {name} {amount:+.0f} руб."
+class OperationParseError(Exception):
+    def __init__(self, line_no: int, line: str):
+        super().__init__(line_no, line)
+        self.line_no = line_no
+        self.line = line
+
+
+OPERATION_RE = re.compile(
+    fr"^(?:@\w+\s+)?(pay|spend)\s+(\w+)\s+({AMOUNT_PATTERN})(?:\s+(.*))?$",
+    flags=re.IGNORECASE,
+)
+
+
+def parse_operations(text: str) -> tp.List[tp.Tuple[str, float, str]]:
+    """
+    Parse one operation per line: '[@bot] pay|spend Name amount [comment]'.
+
+    Raises `OperationParseError` on the first line that doesn't match.
+    """
+    operations = []
+    for line_no, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line:
+            continue
+        match = OPERATION_RE.match(line)
+        if match is None:
+            raise OperationParseError(line_no, line)
+        cmd, name, amount_str, comment = match.groups()
+        amount = float(amount_str.replace(",", "."))
+        if cmd.lower() == "spend":
+            amount = -amount
+        operations.append((name, amount, (comment or "").strip()))
+    return operations
+
+
+def format_operation(name: str, amount: float, comment: str) -> str:
+    row = f"{name} {amount:+.0f} руб."
     if comment:
-        reply += f" '{comment}'"
-    await event.reply(reply)
+        row += f" '{comment}'"
+    return row
+
+
+def make_parse_error_reply(error: OperationParseError) -> str:
+    return (
+        f"Что-то не то в строке {error.line_no}: '{error.line}'\n"
+        "Нужно писать 'pay|spend Имя сумма комментарий'. "
+        "Ничего не записано"
+    )
+
+
+def make_unknown_users_reply(error: UserNotExistsError) -> str:
+    names = ", ".join(error.args)
+    return f"Ошибка: таких участников нет: {names}. Ничего не записано"
+
+
+async def notify_rejected(
+    bot: Bot,
+    t_chat_id: int,
+    t_message_id: int,
+    error: UserNotExistsError,
+) -> None:
+    """Tell a chat that a message acked before DB write is not written"""
+    await bot.send_message(
+        t_chat_id,
+        make_unknown_users_reply(error),
+        reply_to_message_id=t_message_id,
+        allow_sending_without_reply=True,
+    )
+
+
+def make_not_written_reply() -> str:
+    return "Ошибка: база недоступна, ничего не записано. Повторите позже"
+
+
+def make_operations_reply(
+    operations: tp.Sequence[tp.Tuple[str, float, str]],
+) -> str:
+    if len(operations) == 1:
+        return "Записано: " + format_operation(*operations[0])
+
+    total = sum(amount for _, amount, _ in operations)
+    reply = f"Записано операций: {len(operations)}\n"
+    reply += "\n".join(f"- {format_operation(*op)}" for op in operations)
+    reply += f"\n\nИтого: {total:+.0f} руб."
+    return reply
+
+
+def parse_operations_message(text: str) -> tp.Dict[str, tp.Any]:
+    try:
+        return {"operations": parse_operations(text), "parse_error": None}
+    except OperationParseError as e:
+        return {"operations": [], "parse_error": e}
+
+
+async def spend_pay_msg_h(
+    event: tt.Message,
+    db_service: DBService,
+    operations: tp.List[tp.Tuple[str, float, str]],
+    parse_error: tp.Optional[OperationParseError],
+) -> None:
+    if parse_error is not None:
+        await event.reply(make_parse_error_reply(parse_error))
+        return
+
+    try:
+        await db_service.add_operations(
+            event.chat.id,
+            operations,
+            t_message_id=event.message_id,
+        )
+    except UserNotExistsError as e:
+        await event.reply(make_unknown_users_reply(e))
+        return
+
+    chat = get_suggest_index(db_service).get_loaded(event.chat.id)
+    if chat is not None:
+        chat.add_operations(operations)
+    await event.reply(make_operations_reply(operations))
+
+
+ParsedMessage = tp.Tuple[tt.Message, tp.List[tp.Tuple[str, float, str]]]
+
+
+async def parse_spend_pay_batch(
+    events: tp.Sequence[tt.Message],
+    db_service: DBService,
+) -> tp.List[ParsedMessage]:
+    """
+    First step of `spend_pay_msg_h` for several messages of one chat.
+
+    Does the bookkeeping of `handle` and replies to messages
+    that can't be parsed. Valid messages are written to DB at once
+    with `write_spend_pay_batch` and answered with `reply_spend_pay_batch`.
+    """
+    suggest_index = get_suggest_index(db_service)
+    parsed = []
+    for event in events:
+        if event.from_user:
+            suggest_index.remember_user_chat(event.from_user.id, event.chat.id)
+        try:
+            parsed.append((event, parse_operations(event.text)))
+        except OperationParseError as e:
+            await event.reply(make_parse_error_reply(e))
+    return parsed
+
+
+async def write_spend_pay_batch(
+    parsed: tp.Sequence[ParsedMessage],
+    db_service: DBService,
+) -> tp.List[tp.Optional[UserNotExistsError]]:
+    t_chat_id = parsed[0][0].chat.id
+    try:
+        await db_service.add_chat(t_chat_id)
+    except ChatAlreadyExistsError:
+        pass
+    return await db_service.add_operations_batch(
+        t_chat_id,
+        [(event.message_id, operations) for event, operations in parsed],
+    )
+
+
+async def reply_spend_pay_batch(
+    parsed: tp.Sequence[ParsedMessage],
+    errors: tp.Sequence[tp.Optional[UserNotExistsError]],
+    db_service: DBService,
+) -> None:
+    chat = get_suggest_index(db_service).get_loaded(parsed[0][0].chat.id)
+    for (event, operations), error in zip(parsed, errors):
+        if error is not None:
+            reply = make_unknown_users_reply(error)
+        else:
+            reply = make_operations_reply(operations)
+            if chat is not None:
+                chat.add_operations(operations)
+        await event.reply(reply)
+
+
+def make_spend_pay_regexp(bot_name: str) -> str:
+    return fr"^@{bot_name}\s+(pay|spend)\s+\w+\s+\d+((\.|,)\d+)?.*$"
 
 
 async def get_history_h(event: tt.Message, db_service: DBService) -> None:
@@ -198,10 +441,29 @@ async def get_history_h(event: tt.Message, db_service: DBService) -> None:
     await event.reply(reply, reply_markup=keyboard)
 
 
+def format_chat_history(hist: tp.Sequence[tp.Tuple[str, float, str]]) -> str:
+    balance = sum([r[1] for r in hist])
+    reply = "\n".join([f"- {nm} {am:+.0f} '{cm}'" for nm, am, cm in hist])
+    reply += f"\n\nБаланс: {balance:+.0f} руб."
+    return reply
+
+
+def format_user_history(
+    user: str,
+    hist: tp.Sequence[tp.Tuple[float, str]],
+) -> str:
+    balance = sum([r[0] for r in hist])
+    reply = f"Итак, {user}\n"
+    reply += "\n".join([f"{am:+.0f} '{cm}'" for am, cm in hist])
+    reply += f"\n\nБаланс: {balance:+.0f} руб."
+    return reply
+
+
 async def get_history_cb_h(
     query: tt.CallbackQuery,
     callback_data: tp.Dict[str, str],
     db_service: DBService,
+    offloader: Offloader,
 ) -> None:
     await query.answer()
     user = callback_data["name"]
@@ -209,14 +471,15 @@ async def get_history_cb_h(
     chat_id = query.message.chat.id
     if user == CHAT:
         hist = await db_service.get_chat_operations(chat_id)
-        balance = sum([r[1] for r in hist])
-        reply = "\n".join([f"- {nm} {am:+.0f} '{cm}'" for nm, am, cm in hist])
+        reply = await offloader.run(format_chat_history, hist, size=len(hist))
     else:
         hist = await db_service.get_user_operations(chat_id, user)
-        balance = sum([r[0] for r in hist])
-        reply = f"Итак, {user}\n"
-        reply += "\n".join([f"{am:+.0f} '{cm}'" for am, cm in hist])
-    reply += f"\n\nБаланс: {balance:+.0f} руб."
+        reply = await offloader.run(
+            format_user_history,
+            user,
+            hist,
+            size=len(hist),
+        )
     await query.bot.send_message(
         chat_id,
         reply,
@@ -244,12 +507,20 @@ def format_status_reply(statuses: tp.Dict[str, float]):
     return "\n".join(rows)
 
 
-async def get_status_h(event: tt.Message, db_service: DBService) -> None:
+async def get_status_h(
+    event: tt.Message,
+    db_service: DBService,
+    offloader: Offloader,
+) -> None:
     history = await db_service.get_chat_operations(event.chat.id)
-    rest = sum([r[1] for r in history])
+    grouped = await offloader.run(
+        calc_grouped_amounts,
+        history,
+        size=len(history),
+    )
+    rest = sum(grouped.values())
 
     if rest < 1:
-        grouped = calc_grouped_amounts(history)
         reply = "В итоге имеем:\n" + format_status_reply(grouped)
         if rest < -1:
             reply = (
@@ -278,10 +549,15 @@ async def get_statuses_cb_h(
     query: tt.CallbackQuery,
     callback_data: tp.Dict[str, str],
     db_service: DBService,
+    offloader: Offloader,
 ) -> None:
     await query.answer()
     history = await db_service.get_chat_operations(query.message.chat.id)
-    statuses = calc_grouped_amounts(history)
+    statuses = await offloader.run(
+        calc_grouped_amounts,
+        history,
+        size=len(history),
+    )
 
     variant = callback_data["variant"]
     if variant == "divide":
@@ -296,70 +572,357 @@ async def get_statuses_cb_h(
     await query.bot.send_message(query.message.chat.id, reply)
 
 
-async def other_msg_h(event: tt.Message, db_service: DBService) -> None:
-    reply = f"Что-то я вас не пойму, выражайтесь яснее!"
-    await event.reply(reply)
+REPORT_PERIODS = {
+    "week": (4, "Траты по неделям"),
+    "month": (3, "Траты по месяцам"),
+}
+REPORT_TOP_CATEGORIES = 5
+
+
+def format_report_reply(
+    title: str,
+    totals: tp.Sequence[tp.Tuple[date, str, float, float]],
+    categories: tp.Sequence[tp.Tuple[str, float, int]],
+) -> str:
+    rows = [f"{title}:"]
+    for period, period_totals in groupby(totals, key=lambda t: t[0]):
+        rows.append(f"\n{period:%d.%m.%Y}:")
+        rows.extend(
+            f"- {name} {spent:.0f} руб."
+            for _, name, spent, _ in period_totals
+        )
+    if categories:
+        rows.append("\nБольше всего потрачено на:")
+        rows.extend(
+            f"- {category} {spent:.0f} руб. ({n_actions})"
+            for category, spent, n_actions in categories
+        )
+    return "\n".join(rows)
 
 
-def add_handlers(
-    dp: Dispatcher,
+async def report_h(
+    event: tt.Message,
     db_service: DBService,
-    config: ServiceConfig,
+    args: str,
 ) -> None:
-    dp.register_message_handler(
-        partial(handle, start_h, db_service),
-        commands={"start"},
-    )
-    dp.register_message_handler(
-        partial(handle, help_h, db_service),
-        commands={"help"},
+    period = args.lower() or "month"
+    if period not in REPORT_PERIODS:
+        reply = "Что-то не то: нужно писать '/report week' или '/report month'"
+        await event.reply(reply)
+        return
+
+    n_periods, title = REPORT_PERIODS[period]
+    totals = await db_service.get_period_totals(
+        event.chat.id,
+        period,
+        n_periods,
     )
-    dp.register_message_handler(
-        partial(handle, reset_h, db_service),
-        commands={"reset"},
+    if not totals:
+        await event.reply("За этот период операций не было")
+        return
+    categories = await db_service.get_top_categories(
+        event.chat.id,
+        period,
+        n_periods,
+        REPORT_TOP_CATEGORIES,
     )
-    dp.register_message_handler(
-        partial(handle, add_user_h, db_service),
-        commands={"add"},
+    reply = format_report_reply(title, totals, categories)
+    await event.reply(reply)
+
+
+FIND_PAGE_SIZE = 10
+
+
+def format_find_reply(
+    matches: tp.Sequence[tp.Tuple[datetime, str, float, str]],
+    n_matches: int,
+    spent: float,
+    paid: float,
+    page: int,
+) -> str:
+    rows = [
+        f"Найдено: {n_matches}, потрачено {spent:.0f} руб., "
+        f"оплачено {paid:.0f} руб.\n"
+    ]
+    start = page * FIND_PAGE_SIZE + 1
+    for i, (added_at, name, amount, comment) in enumerate(matches, start):
+        operation = format_operation(name, amount, comment)
+        rows.append(f"{i}. {added_at:%d.%m.%Y} {operation}")
+    n_pages = -(-n_matches // FIND_PAGE_SIZE)
+    if n_pages > 1:
+        rows.append(f"\nСтраница {page + 1} из {n_pages}")
+    return "\n".join(rows)
+
+
+def make_find_kb(page: int, n_matches: int) -> tt.InlineKeyboardMarkup:
+    buttons = []
+    if page > 0:
+        buttons.append(
+            tt.InlineKeyboardButton(
+                "<<",
+                callback_data=find_cb.new(page=page - 1),
+            )
+        )
+    if (page + 1) * FIND_PAGE_SIZE < n_matches:
+        buttons.append(
+            tt.InlineKeyboardButton(
+                ">>",
+                callback_data=find_cb.new(page=page + 1),
+            )
+        )
+    return tt.InlineKeyboardMarkup(row_width=2).add(*buttons)
+
+
+async def make_find_page(
+    db_service: DBService,
+    t_chat_id: int,
+    text: str,
+    page: int,
+) -> tp.Tuple[str, tp.Optional[tt.InlineKeyboardMarkup]]:
+    matches, n_matches, spent, paid = await db_service.find_operations(
+        t_chat_id,
+        text,
+        FIND_PAGE_SIZE,
+        page * FIND_PAGE_SIZE,
     )
-    dp.register_message_handler(
-        partial(handle, delete_user_h, db_service),
-        commands={"delete"},
+    if not matches:
+        return "Ничего не нашлось", None
+    reply = format_find_reply(matches, n_matches, spent, paid, page)
+    return reply, make_find_kb(page, n_matches)
+
+
+async def find_h(
+    event: tt.Message,
+    db_service: DBService,
+    args: str,
+) -> None:
+    if not args:
+        await event.reply("Что искать? Напишите '/find текст'")
+        return
+    reply, keyboard = await make_find_page(db_service, event.chat.id, args, 0)
+    await event.reply(reply, reply_markup=keyboard)
+
+
+async def find_cb_h(
+    query: tt.CallbackQuery,
+    callback_data: tp.Dict[str, str],
+    db_service: DBService,
+) -> None:
+    await query.answer()
+    # Search text is taken from the '/find' message the page replies to
+    find_message = query.message.reply_to_message
+    if find_message is None:
+        return
+    text = find_message.get_args().strip()
+    page = int(callback_data["page"])
+    reply, keyboard = await make_find_page(
+        db_service,
+        query.message.chat.id,
+        text,
+        page,
     )
-    dp.register_message_handler(
-        partial(handle, get_users_h, db_service),
-        commands={"users"},
+    await query.message.edit_text(reply, reply_markup=keyboard)
+
+
+EVERY_PERIODS = {
+    "day": "day",
+    "день": "day",
+    "week": "week",
+    "неделю": "week",
+    "month": "month",
+    "месяц": "month",
+}
+EVERY_PERIOD_NAMES = {
+    "day": "каждый день",
+    "week": "каждую неделю",
+    "month": "каждый месяц",
+}
+EVERY_USAGE = (
+    "Что-то не то: нужно писать "
+    "'/every day|week|month pay|spend Имя сумма комментарий'"
+)
+
+
+def format_schedules_reply(
+    schedules: tp.Sequence[tp.Tuple[UUID, str, float, str, str]],
+) -> str:
+    if not schedules:
+        return "Регулярных операций нет"
+    rows = ["Регулярные операции:"]
+    for i, (_, name, amount, comment, period) in enumerate(schedules, 1):
+        period_name = EVERY_PERIOD_NAMES[period]
+        operation = format_operation(name, amount, comment)
+        rows.append(f"{i}. {period_name.capitalize()}: {operation}")
+    rows.append("\nЧтобы отменить, напишите '/every stop Номер'")
+    return "\n".join(rows)
+
+
+async def every_h(
+    event: tt.Message,
+    db_service: DBService,
+    scheduler: Scheduler,
+    args: str,
+) -> None:
+    if not args:
+        schedules = await db_service.get_chat_schedules(event.chat.id)
+        await event.reply(format_schedules_reply(schedules))
+        return
+
+    period_arg, _, operation_str = args.partition(" ")
+    if period_arg.lower() == "stop":
+        schedules = await db_service.get_chat_schedules(event.chat.id)
+        number = operation_str.strip()
+        if not number.isdigit() or not 1 <= int(number) <= len(schedules):
+            reply = "Что-то не то: нужен номер из списка '/every'"
+        else:
+            schedule_id, name, amount, comment, _ = schedules[int(number) - 1]
+            await db_service.delete_schedule(schedule_id)
+            reply = "Отменено: " + format_operation(name, amount, comment)
+        await event.reply(reply)
+        return
+
+    period = EVERY_PERIODS.get(period_arg.lower())
+    try:
+        operations = parse_operations(operation_str)
+    except OperationParseError:
+        operations = []
+    if period is None or len(operations) != 1:
+        await event.reply(EVERY_USAGE)
+        return
+
+    name, amount, comment = operations[0]
+    try:
+        schedule_id = await db_service.add_schedule(
+            event.chat.id,
+            name,
+            amount,
+            comment,
+            period,
+        )
+    except UserNotExistsError as e:
+        await event.reply(make_unknown_users_reply(e))
+        return
+    scheduler.push(schedule_id, 0, 0)
+
+    operation = format_operation(name, amount, comment)
+    reply = (
+        f"Буду записывать {EVERY_PERIOD_NAMES[period]}, "
+        f"начиная с сегодня: {operation}"
     )
-    dp.register_message_handler(
-        partial(handle, pay_h, db_service),
-        commands={"pay"},
+    await event.reply(reply)
+
+
+def make_inline_result(
+    result_id: str,
+    entry: str,
+    bot_name: str,
+) -> tt.InlineQueryResultArticle:
+    return tt.InlineQueryResultArticle(
+        id=result_id,
+        title=entry,
+        input_message_content=tt.InputTextMessageContent(
+            f"@{bot_name} {entry}",
+        ),
     )
-    dp.register_message_handler(
-        partial(handle, spend_h, db_service),
-        commands={"spend"},
+
+
+async def inline_query_h(
+    query: tt.InlineQuery,
+    db_service: DBService,
+    bot_name: str,
+) -> None:
+    suggest_index = get_suggest_index(db_service)
+    t_chat_id = suggest_index.get_user_chat(query.from_user.id)
+    if t_chat_id is None:
+        await query.answer([], cache_time=0, is_personal=True)
+        return
+
+    chat = await suggest_index.get_chat(t_chat_id, db_service)
+    entries = make_inline_entries(chat, query.query)
+    results = [
+        make_inline_result(str(i), entry, bot_name)
+        for i, entry in enumerate(entries)
+    ]
+    await query.answer(results, cache_time=0, is_personal=True)
+
+
+async def other_msg_h(event: tt.Message, db_service: DBService) -> None:
+    reply = f"Что-то я вас не пойму, выражайтесь яснее!"
+    await event.reply(reply)
+
+
+def make_router(
+    bot_name: str,
+    scheduler: Scheduler,
+    offloader: Offloader,
+) -> MessageRouter:
+    router = MessageRouter(bot_name)
+    router.add_command("start", start_h)
+    router.add_command("help", help_h)
+    router.add_command("reset", reset_h, parse_args)
+    router.add_command("add", add_user_h, parse_name)
+    router.add_command("delete", delete_user_h, parse_name)
+    router.add_command("users", get_users_h)
+    router.add_command("pay", pay_h)
+    router.add_command("spend", spend_h)
+    router.add_command("history", get_history_h)
+    router.add_command("status", partial(get_status_h, offloader=offloader))
+    router.add_command("report", report_h, parse_args)
+    router.add_command(
+        "every",
+        partial(every_h, scheduler=scheduler),
+        parse_args,
     )
-    bot_name = config.telegram_config.bot_name
-    dp.register_message_handler(
-        partial(handle, spend_pay_msg_h, db_service),
-        regexp=fr"^@{bot_name}\s+(pay|spend)\s+\w+\s+\d+((\.|,)\d+)?.*$",
+    router.add_command("find", find_h, parse_args)
+    router.set_operations_route(
+        make_spend_pay_regexp(bot_name),
+        spend_pay_msg_h,
+        parse_operations_message,
     )
+    router.set_mention_route(other_msg_h)
+    return router
+
+
+def add_handlers(
+    dp: Dispatcher,
+    db_service: DBService,
+    bot_config: BotConfig,
+    scheduler: Scheduler,
+    offloader: Offloader,
+) -> None:
+    bot_name = bot_config.bot_name
+    # All text messages go through one handler, see `MessageRouter`
     dp.register_message_handler(
-        partial(handle, get_history_h, db_service),
-        commands={"history"},
+        partial(
+            handle_routed,
+            make_router(bot_name, scheduler, offloader),
+            db_service,
+        ),
     )
     dp.register_callback_query_handler(
-        partial(handle_cb, get_history_cb_h, db_service),
+        partial(
+            handle_cb,
+            partial(get_history_cb_h, offloader=offloader),
+            db_service,
+        ),
         user_cb.filter(cb_type="history"),
     )
-    dp.register_message_handler(
-        partial(handle, get_status_h, db_service),
-        commands={"status"},
-    )
     dp.register_callback_query_handler(
-        partial(handle_cb, get_statuses_cb_h, db_service),
+        partial(
+            handle_cb,
+            partial(get_statuses_cb_h, offloader=offloader),
+            db_service,
+        ),
         status_cb.filter(variant=["return", "divide"]),
     )
-    dp.register_message_handler(
-        partial(handle, other_msg_h, db_service),
-        regexp=fr"@{bot_name}",
+    dp.register_callback_query_handler(
+        partial(handle_cb, find_cb_h, db_service),
+        find_cb.filter(),
+    )
+    dp.register_inline_handler(
+        partial(
+            handle_inline,
+            partial(inline_query_h, bot_name=bot_name),
+            db_service,
+        ),
     )
@@ -0,0 +1,609 @@
+import asyncio
+import os
+import typing as tp
+from collections import deque
+from functools import partial
+from itertools import islice
+from pathlib import Path
+
+import orjson
+from asyncpg import Connection, InterfaceError, PostgresConnectionError
+
+from .db import DBService, UserNotExistsError
+from .log import app_logger
+from .settings import JournalConfig
+
+Operation = tp.Tuple[str, float, str]
+T = tp.TypeVar("T")
+ApplyFunc = tp.Callable[
+    [int, tp.List[tp.Tuple[int, tp.List[Operation]]]],
+    tp.Awaitable[tp.List[tp.Optional[Exception]]],
+]
+RejectFunc = tp.Callable[[int, int, UserNotExistsError], tp.Awaitable[None]]
+
+SEGMENT_PREFIX = "segment-"
+SEGMENT_SUFFIX = ".log"
+CHECKPOINT_FILE = "checkpoint.json"
+
+TRANSIENT_ERRORS = (
+    OSError,
+    asyncio.TimeoutError,
+    InterfaceError,
+    PostgresConnectionError,
+)
+
+
+class JournalEntry(tp.NamedTuple):
+    seq: int
+    t_chat_id: int
+    t_message_id: int
+    operations: tp.List[Operation]
+    segment: int
+    end_offset: int
+
+
+class Journal:
+    """
+    Local append-only log of operations that are not yet in DB.
+
+    Records are JSON lines written to segment files and fsync'ed
+    before `append` returns. A background replayer applies them
+    to DB in batches; it is idempotent thanks to Telegram message ids,
+    so replaying an entry twice (e.g. after a crash) is harmless.
+    The replay position is saved to a checkpoint file
+    and fully applied segments are removed.
+    """
+
+    def __init__(self, config: JournalConfig) -> None:
+        self.path = Path(config.journal_dir)
+        self.segment_max_size = config.journal_segment_max_size
+        self.retry_interval = config.journal_retry_interval
+        self.replay_batch_size = config.journal_replay_batch_size
+
+        self._pending: tp.Deque[JournalEntry] = deque()
+        self._acks: tp.Dict[tp.Tuple[int, int], asyncio.Future] = {}
+        self._to_write: tp.List[tp.Tuple[bytes, asyncio.Future]] = []
+        self._flushing = False
+        self._next_seq = 0
+        self._applied_seq = -1
+        self._applied_seqs: tp.Set[int] = set()
+        self._applied_position: tp.Optional[tp.Tuple[int, int]] = None
+
+        self._segment = 0
+        self._offset = 0
+        self._fd: tp.Optional[int] = None
+        self._has_pending: tp.Optional[asyncio.Event] = None
+        self._replayer: tp.Optional[asyncio.Task] = None
+        self._on_rejected: tp.Optional[RejectFunc] = None
+        self._checkpointing: tp.Optional[asyncio.Future] = None
+
+    # --- files, all called in executor ---
+
+    def _segment_path(self, segment: int) -> Path:
+        return self.path / f"{SEGMENT_PREFIX}{segment:08d}{SEGMENT_SUFFIX}"
+
+    def _list_segments(self) -> tp.List[int]:
+        return sorted(
+            int(p.name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+            for p in self.path.glob(f"{SEGMENT_PREFIX}*{SEGMENT_SUFFIX}")
+        )
+
+    def _open_segment(self, segment: int) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+        flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND
+        self._fd = os.open(self._segment_path(segment), flags, 0o644)
+        self._segment = segment
+        self._offset = 0
+
+    def _read_segment(
+        self,
+        segment: int,
+        offset: int,
+    ) -> tp.Iterator[tp.Tuple[tp.Dict[str, tp.Any], int]]:
+        data = self._segment_path(segment).read_bytes()
+        while offset < len(data):
+            end = data.find(b"\n", offset)
+            if end == -1:
+                app_logger.warning(
+                    "Journal segment %s has incomplete tail, ignoring it",
+                    segment,
+                )
+                return
+            try:
+                record = orjson.loads(data[offset:end])
+            except orjson.JSONDecodeError:
+                app_logger.warning(
+                    "Journal segment %s is corrupted at %s, ignoring tail",
+                    segment,
+                    offset,
+                )
+                return
+            offset = end + 1
+            yield record, offset
+
+    def _open_sync(self) -> None:
+        self.path.mkdir(parents=True, exist_ok=True)
+        checkpoint_path = self.path / CHECKPOINT_FILE
+        cp_segment, cp_offset = 0, 0
+        if checkpoint_path.exists():
+            checkpoint = orjson.loads(checkpoint_path.read_bytes())
+            cp_segment, cp_offset = checkpoint["segment"], checkpoint["offset"]
+
+        segments = self._list_segments()
+        for segment in segments:
+            if segment < cp_segment:
+                continue
+            offset = cp_offset if segment == cp_segment else 0
+            for record, end_offset in self._read_segment(segment, offset):
+                self._pending.append(
+                    JournalEntry(
+                        seq=self._next_seq,
+                        t_chat_id=record["chat"],
+                        t_message_id=record["msg"],
+                        operations=[tuple(op) for op in record["ops"]],
+                        segment=segment,
+                        end_offset=end_offset,
+                    )
+                )
+                self._next_seq += 1
+
+        # Never append after a possibly torn tail
+        self._open_segment(max(segments, default=cp_segment) + 1)
+        if self._pending:
+            self._remove_segments_before(cp_segment)
+        else:
+            self._remove_segments_before(self._segment)
+
+    def _write_sync(
+        self,
+        records: tp.List[bytes],
+    ) -> tp.List[tp.Tuple[int, int]]:
+        assert self._fd is not None
+        data = b"".join(records)
+        try:
+            view = memoryview(data)
+            while view:
+                written = os.write(self._fd, view)
+                view = view[written:]
+            os.fsync(self._fd)
+        except OSError:
+            # Start a new segment so that next records are not glued
+            # to a partially written one
+            self._open_segment(self._segment + 1)
+            raise
+
+        positions = []
+        for record in records:
+            self._offset += len(record)
+            positions.append((self._segment, self._offset))
+        if self._offset >= self.segment_max_size:
+            self._open_segment(self._segment + 1)
+        return positions
+
+    def _remove_segments_before(self, segment: int) -> None:
+        for old_segment in self._list_segments():
+            if old_segment < segment:
+                self._segment_path(old_segment).unlink()
+
+    def _save_checkpoint_sync(self, position: tp.Tuple[int, int]) -> None:
+        segment, offset = position
+        data = orjson.dumps({"segment": segment, "offset": offset})
+        tmp_path = self.path / f"{CHECKPOINT_FILE}.tmp"
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, self.path / CHECKPOINT_FILE)
+        self._remove_segments_before(segment)
+
+    def _close_sync(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    # --- event loop side ---
+
+    async def open(
+        self,
+        apply: ApplyFunc,
+        on_rejected: tp.Optional[RejectFunc] = None,
+    ) -> None:
+        """
+        Start replaying entries with `apply`.
+
+        `on_rejected` is called for entries with unknown users
+        that nobody waits for: released ones and ones replayed
+        after restart.
+        """
+        self._on_rejected = on_rejected
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._open_sync)
+        self._has_pending = asyncio.Event()
+        if self._pending:
+            app_logger.info(
+                "Journal has %s entries to replay",
+                len(self._pending),
+            )
+            self._has_pending.set()
+        self._replayer = loop.create_task(self._replay(apply))
+
+    async def close(self) -> None:
+        if self._replayer is not None:
+            self._replayer.cancel()
+            try:
+                await self._replayer
+            except asyncio.CancelledError:
+                pass
+        if self._checkpointing is not None:
+            await self._checkpointing
+        loop = asyncio.get_running_loop()
+        if self._applied_position is not None:
+            await loop.run_in_executor(
+                None,
+                self._save_checkpoint_sync,
+                self._applied_position,
+            )
+        await loop.run_in_executor(None, self._close_sync)
+
+    async def _flush(self) -> None:
+        loop = asyncio.get_running_loop()
+        self._flushing = True
+        try:
+            while self._to_write:
+                # Group commit: everything appended during
+                # the previous fsync is written by one fsync
+                batch, self._to_write = self._to_write, []
+                records = [record for record, _ in batch]
+                try:
+                    positions = await loop.run_in_executor(
+                        None,
+                        self._write_sync,
+                        records,
+                    )
+                except OSError as e:
+                    for _, written in batch:
+                        written.set_exception(e)
+                else:
+                    for position, (_, written) in zip(positions, batch):
+                        written.set_result(position)
+        finally:
+            self._flushing = False
+
+    async def append(
+        self,
+        t_chat_id: int,
+        t_message_id: int,
+        operations: tp.Sequence[Operation],
+    ) -> "asyncio.Future[tp.Optional[Exception]]":
+        """
+        Durably write operations to the journal.
+
+        Returns a future that is resolved when the operations are applied
+        to DB: with None on success or with the error that made
+        the entry impossible to apply.
+        """
+        loop = asyncio.get_running_loop()
+        record = orjson.dumps(
+            {"chat": t_chat_id, "msg": t_message_id, "ops": operations}
+        ) + b"\n"
+        written = loop.create_future()
+        self._to_write.append((record, written))
+        if not self._flushing:
+            await self._flush()
+        segment, end_offset = await written
+
+        key = (t_chat_id, t_message_id)
+        ack = self._acks.get(key)
+        if ack is None:
+            ack = self._acks[key] = loop.create_future()
+        self._pending.append(
+            JournalEntry(
+                seq=self._next_seq,
+                t_chat_id=t_chat_id,
+                t_message_id=t_message_id,
+                operations=list(operations),
+                segment=segment,
+                end_offset=end_offset,
+            )
+        )
+        self._next_seq += 1
+        assert self._has_pending is not None
+        self._has_pending.set()
+        return ack
+
+    def release(self, t_chat_id: int, t_message_id: int) -> None:
+        """Stop waiting for the entry, its rejection goes to `on_rejected`"""
+        self._acks.pop((t_chat_id, t_message_id), None)
+
+    def _resolve(
+        self,
+        entry: JournalEntry,
+        error: tp.Optional[Exception],
+    ) -> bool:
+        ack = self._acks.pop((entry.t_chat_id, entry.t_message_id), None)
+        if ack is None or ack.done():
+            return False
+        ack.set_result(error)
+        return True
+
+    async def _reject(
+        self,
+        entry: JournalEntry,
+        error: UserNotExistsError,
+    ) -> None:
+        if self._on_rejected is None:
+            return
+        try:
+            await self._on_rejected(
+                entry.t_chat_id,
+                entry.t_message_id,
+                error,
+            )
+        except Exception:
+            app_logger.exception(
+                "Failed to report rejection of message %s",
+                entry.t_message_id,
+            )
+
+    async def _apply_batch(
+        self,
+        apply: ApplyFunc,
+        entries: tp.List[JournalEntry],
+    ) -> bool:
+        """
+        Apply entries with one DB call per chat.
+
+        Returns False if some entries must be retried. Entries that are
+        applied out of order (their chat succeeded, while an earlier
+        entry of another chat failed) are remembered in `_applied_seqs`.
+        """
+        chats_entries: tp.Dict[int, tp.List[JournalEntry]] = {}
+        for entry in entries:
+            if not self.is_applied(entry):
+                chats_entries.setdefault(entry.t_chat_id, []).append(entry)
+        results = await asyncio.gather(
+            *(
+                apply(
+                    t_chat_id,
+                    [(e.t_message_id, e.operations) for e in chat_entries],
+                )
+                for t_chat_id, chat_entries in chats_entries.items()
+            ),
+            return_exceptions=True,
+        )
+
+        completed = True
+        for chat_entries, result in zip(chats_entries.values(), results):
+            if isinstance(result, TRANSIENT_ERRORS):
+                completed = False
+                continue
+            if isinstance(result, Exception):
+                app_logger.error(
+                    "Journal entries of messages %s dropped",
+                    [e.t_message_id for e in chat_entries],
+                    exc_info=result,
+                )
+                errors = [result] * len(chat_entries)
+            elif isinstance(result, BaseException):
+                raise result
+            else:
+                errors = result
+            for entry, error in zip(chat_entries, errors):
+                if isinstance(error, UserNotExistsError):
+                    app_logger.warning(
+                        "Journal entry of message %s dropped: "
+                        "unknown users %s",
+                        entry.t_message_id,
+                        error.args,
+                    )
+                self._applied_seqs.add(entry.seq)
+                is_resolved = self._resolve(entry, error)
+                if not is_resolved and isinstance(error, UserNotExistsError):
+                    await self._reject(entry, error)
+
+        while self._pending and self._pending[0].seq in self._applied_seqs:
+            entry = self._pending.popleft()
+            self._applied_seqs.discard(entry.seq)
+            self._applied_seq = entry.seq
+            self._applied_position = (entry.segment, entry.end_offset)
+        return completed
+
+    async def _replay(self, apply: ApplyFunc) -> None:
+        loop = asyncio.get_running_loop()
+        assert self._has_pending is not None
+        saved_position = None
+        while True:
+            await self._has_pending.wait()
+            while self._pending:
+                batch = list(islice(self._pending, self.replay_batch_size))
+                completed = await self._apply_batch(apply, batch)
+
+                # Checkpoint after every batch, so that segments are
+                # removed even if new entries keep coming
+                if self._applied_position != saved_position:
+                    saved_position = self._applied_position
+                    self._checkpointing = loop.run_in_executor(
+                        None,
+                        self._save_checkpoint_sync,
+                        saved_position,
+                    )
+                    # Not interrupted by `close`, it waits for it instead
+                    await asyncio.shield(self._checkpointing)
+                if not completed:
+                    app_logger.warning(
+                        "Failed to replay journal (%s entries pending), "
+                        "retrying in %s s",
+                        len(self._pending),
+                        self.retry_interval,
+                    )
+                    await asyncio.sleep(self.retry_interval)
+            self._has_pending.clear()
+
+    def get_pending(self, t_chat_id: int) -> tp.List[JournalEntry]:
+        return [e for e in self._pending if e.t_chat_id == t_chat_id]
+
+    def is_applied(self, entry: JournalEntry) -> bool:
+        return (
+            entry.seq <= self._applied_seq or entry.seq in self._applied_seqs
+        )
+
+
+class JournaledDBService(DBService):
+    """
+    `DBService` that writes operations to a local journal first.
+
+    Callers wait for DB at most `ack_timeout` seconds, after that
+    operations stay in the journal and are applied in background,
+    and those rejected later are reported with `on_rejected`.
+    Reads include operations that are not yet applied.
+    """
+
+    journal: Journal
+    ack_timeout: float
+    on_rejected: tp.Optional[RejectFunc] = None
+
+    async def setup(self) -> None:
+        await super().setup()
+        await self.journal.open(
+            partial(DBService.add_operations_batch, self),
+            self.on_rejected,
+        )
+        app_logger.info("Journal initialized")
+
+    async def cleanup(self) -> None:
+        await self.journal.close()
+        app_logger.info("Journal shutdown")
+        await super().cleanup()
+
+    async def add_operations(
+        self,
+        t_chat_id: int,
+        operations: tp.Sequence[Operation],
+        t_message_id: tp.Optional[int] = None,
+    ) -> None:
+        if t_message_id is None:
+            await super().add_operations(t_chat_id, operations)
+            return
+
+        ack = await self.journal.append(t_chat_id, t_message_id, operations)
+        try:
+            error = await asyncio.wait_for(
+                asyncio.shield(ack),
+                self.ack_timeout,
+            )
+        except asyncio.TimeoutError:
+            self.journal.release(t_chat_id, t_message_id)
+            if not ack.done():
+                app_logger.warning(
+                    "Message %s is journaled, but not applied to DB yet",
+                    t_message_id,
+                )
+                return
+            error = ack.result()
+        if error is not None:
+            raise error
+
+    async def add_operations_batch(
+        self,
+        t_chat_id: int,
+        batch: tp.Sequence[
+            tp.Tuple[tp.Optional[int], tp.Sequence[Operation]]
+        ],
+    ) -> tp.List[tp.Optional[UserNotExistsError]]:
+        """
+        Same as `add_operations`, but for several messages.
+
+        Messages are journaled with one group commit. Batches with
+        messages without ids can't be journaled and go to DB directly.
+        """
+        if any(t_message_id is None for t_message_id, _ in batch):
+            return await super().add_operations_batch(t_chat_id, batch)
+
+        acks = await asyncio.gather(
+            *(
+                self.journal.append(t_chat_id, t_message_id, operations)
+                for t_message_id, operations in batch
+            )
+        )
+        _, not_applied = await asyncio.wait(acks, timeout=self.ack_timeout)
+        for (t_message_id, _), ack in zip(batch, acks):
+            if ack in not_applied:
+                self.journal.release(t_chat_id, t_message_id)
+        not_applied = {ack for ack in not_applied if not ack.done()}
+        if not_applied:
+            app_logger.warning(
+                "%s of %s messages are journaled, but not applied to DB yet",
+                len(not_applied),
+                len(acks),
+            )
+
+        errors: tp.List[tp.Optional[UserNotExistsError]] = []
+        for ack in acks:
+            error = ack.result() if ack.done() else None
+            if error is not None and not isinstance(error, UserNotExistsError):
+                raise error
+            errors.append(error)
+        return errors
+
+    async def _read_with_pending(
+        self,
+        t_chat_id: int,
+        read: tp.Callable[[tp.Optional[Connection]], tp.Awaitable[T]],
+    ) -> tp.Tuple[T, tp.List[JournalEntry]]:
+        """
+        Read from DB and find journal entries that are not in the result.
+
+        Entries are taken before the read. Those applied by the time
+        of the read are found by `applied_messages` in the same snapshot,
+        so every entry is counted exactly once whatever the replayer
+        is doing meanwhile.
+        """
+        pending = list(
+            {
+                entry.t_message_id: entry
+                for entry in self.journal.get_pending(t_chat_id)
+            }.values()
+        )
+        if not pending:
+            return await read(None), []
+
+        async with self.pool.acquire() as conn, conn.transaction(
+            isolation="repeatable_read",
+            readonly=True,
+        ):
+            result = await read(conn)
+            applied = await self.get_applied_messages(
+                t_chat_id,
+                [entry.t_message_id for entry in pending],
+                conn,
+            )
+        return result, [e for e in pending if e.t_message_id not in applied]
+
+    async def get_user_operations(
+        self,
+        t_chat_id: int,
+        name: str,
+        conn: tp.Optional[Connection] = None,
+    ) -> tp.List[tp.Tuple[float, str]]:
+        operations, pending = await self._read_with_pending(
+            t_chat_id,
+            partial(DBService.get_user_operations, self, t_chat_id, name),
+        )
+        for entry in pending:
+            operations.extend(
+                (amount, comment)
+                for op_name, amount, comment in entry.operations
+                if op_name == name
+            )
+        return operations
+
+    async def get_chat_operations(
+        self,
+        t_chat_id: int,
+        conn: tp.Optional[Connection] = None,
+    ) -> tp.List[tp.Tuple[str, float, str]]:
+        operations, pending = await self._read_with_pending(
+            t_chat_id,
+            partial(DBService.get_chat_operations, self, t_chat_id),
+        )
+        for entry in pending:
+            operations.extend(entry.operations)
+        return operations
@@ -1,5 +1,13 @@
+import atexit
+import copy
 import logging.config
+import queue
+import sys
 import typing as tp
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+
+import orjson
 
 from .settings import ServiceConfig
 
@@ -14,19 +22,94 @@ ACCESS_LOG_FORMAT = (
     'request_time="%Tf" '
 )
 
+EMPTY_CTX_VALUE = "-"
+
+bot_name_var: ContextVar[str] = ContextVar(
+    "bot_name",
+    default=EMPTY_CTX_VALUE,
+)
+chat_id_var: ContextVar[tp.Any] = ContextVar(
+    "chat_id",
+    default=EMPTY_CTX_VALUE,
+)
+username_var: ContextVar[tp.Any] = ContextVar(
+    "username",
+    default=EMPTY_CTX_VALUE,
+)
+message_id_var: ContextVar[tp.Any] = ContextVar(
+    "message_id",
+    default=EMPTY_CTX_VALUE,
+)
+
+log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+
+
+def set_bot_context(bot_name: str) -> None:
+    """Set for the whole task of a bot, tasks started from it inherit it"""
+    bot_name_var.set(bot_name)
+
+
+def set_tg_context(
+    chat_id: tp.Optional[int],
+    username: tp.Optional[str],
+    message_id: tp.Optional[int],
+) -> None:
+    chat_id_var.set(EMPTY_CTX_VALUE if chat_id is None else chat_id)
+    username_var.set(username or EMPTY_CTX_VALUE)
+    message_id_var.set(EMPTY_CTX_VALUE if message_id is None else message_id)
+
 
 class TgMsgInfoFilter(logging.Filter):
 
     def filter(self, record: logging.LogRecord) -> bool:
-        setattr(record, "chat_id", "chat_id")
-        setattr(record, "username", "username")
-        setattr(record, "message_id", "message_id")
+        setattr(record, "bot_name", bot_name_var.get())
+        setattr(record, "chat_id", chat_id_var.get())
+        setattr(record, "username", username_var.get())
+        setattr(record, "message_id", message_id_var.get())
         return super().filter(record)
 
 
+class LogQueueHandler(QueueHandler):
+    """
+    Puts records to the `log_queue` without formatting them.
+
+    Formatting (including tracebacks) and writing are done
+    by the `QueueListener` thread, so the event loop is never blocked.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(log_queue)  # type: ignore
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "logger": record.name,
+            "pid": record.process,
+            "bot_name": getattr(record, "bot_name", EMPTY_CTX_VALUE),
+            "chat_id": getattr(record, "chat_id", EMPTY_CTX_VALUE),
+            "username": getattr(record, "username", EMPTY_CTX_VALUE),
+            "message_id": getattr(record, "message_id", EMPTY_CTX_VALUE),
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            data["stack_info"] = self.formatStack(record.stack_info)
+        return orjson.dumps(data, default=str).decode()
+
+
 def get_config(service_config: ServiceConfig) -> tp.Dict[str, tp.Any]:
     level = service_config.log_config.level
-    datetime_format = service_config.log_config.datetime_format
 
     config = {
         "version": 1,
@@ -34,37 +117,21 @@ def get_config(service_config: ServiceConfig) -> tp.Dict[str, tp.Any]:
         "loggers": {
             "root": {
                 "level": level,
-                "handlers": ["console"],
+                "handlers": ["queue"],
                 "propagate": False,
             },
             app_logger.name: {
                 "level": level,
-                "handlers": ["console"],
+                "handlers": ["queue"],
                 "propagate": False,
             },
         },
         "handlers": {
-            "console": {
-                "formatter": "console",
-                "class": "logging.StreamHandler",
-                "stream": "ext://sys.stdout",
+            "queue": {
+                "class": "monya.log.LogQueueHandler",
                 "filters": ["tg_msg_info"],
             },
         },
-        "formatters": {
-            "console": {
-                "format": (
-                    '%(asctime)s '
-                    '- %(levelname)s '
-                    '- pid=%(process)d '
-                    # 'chat_id="%(chat_id)s" '
-                    # 'username="%(username)s" '
-                    # 'message_id="%(message_id)s" '
-                    '| %(message)s'
-                ),
-                "datefmt": datetime_format,
-            },
-        },
         "filters": {
             "tg_msg_info": {"()": "monya.log.TgMsgInfoFilter"},
         },
@@ -73,6 +140,18 @@ def get_config(service_config: ServiceConfig) -> tp.Dict[str, tp.Any]:
     return config
 
 
-def setup_logging(service_config: ServiceConfig) -> None:
+def make_output_handler(service_config: ServiceConfig) -> logging.Handler:
+    datetime_format = service_config.log_config.datetime_format
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter(datefmt=datetime_format))
+    return handler
+
+
+def setup_logging(service_config: ServiceConfig) -> QueueListener:
     config = get_config(service_config)
     logging.config.dictConfig(config)
+
+    listener = QueueListener(log_queue, make_output_handler(service_config))
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,204 @@
+import time
+import typing as tp
+from collections import Counter, OrderedDict
+
+from aiogram import types as tt
+from aiogram.dispatcher.handler import CancelHandler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from .log import app_logger, set_tg_context
+from .settings import FloodConfig
+
+STARTED_AT_KEY = "_started_at"
+FLOOD_NOTICE = "Слишком много сообщений, отвечу чуть позже - подождите немного"
+
+
+class TgContextMiddleware(BaseMiddleware):
+    """Fills logging context variables with info about current update"""
+
+    async def on_pre_process_message(self, message: tt.Message, data: dict):
+        set_tg_context(
+            message.chat.id,
+            message.from_user.username if message.from_user else None,
+            message.message_id,
+        )
+
+    async def on_pre_process_callback_query(
+        self,
+        query: tt.CallbackQuery,
+        data: dict,
+    ):
+        message = query.message
+        set_tg_context(
+            message.chat.id if message else None,
+            query.from_user.username if query.from_user else None,
+            message.message_id if message else None,
+        )
+
+
+class UpdateStatsMiddleware(BaseMiddleware):
+    """Counts updates of one bot and their handling time per window"""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.reset_window()
+
+    def reset_window(self) -> None:
+        self.n_updates: tp.Counter[str] = Counter()
+        self.n_dropped: tp.Counter[str] = Counter()
+        self.handle_time_total = 0.0
+        self.handle_time_max = 0.0
+
+    async def on_pre_process_update(self, update: tt.Update, data: dict):
+        data[STARTED_AT_KEY] = time.monotonic()
+
+    async def on_post_process_update(
+        self,
+        update: tt.Update,
+        results: list,
+        data: dict,
+    ):
+        handle_time = time.monotonic() - data[STARTED_AT_KEY]
+        update_type = next(
+            (key for key in update.values if key != "update_id"),
+            "unknown",
+        )
+        self.n_updates[update_type] += 1
+        self.handle_time_total += handle_time
+        self.handle_time_max = max(self.handle_time_max, handle_time)
+
+    def on_dropped(self, reason: str) -> None:
+        self.n_dropped[reason] += 1
+
+    def get_stats(self) -> tp.Dict[str, tp.Any]:
+        n_updates = sum(self.n_updates.values())
+        return {
+            "n_updates": n_updates,
+            "n_updates_by_type": dict(self.n_updates),
+            "n_dropped": sum(self.n_dropped.values()),
+            "n_dropped_by_reason": dict(self.n_dropped),
+            "handle_time_avg": self.handle_time_total / max(n_updates, 1),
+            "handle_time_max": self.handle_time_max,
+        }
+
+
+class TokenBuckets:
+    """
+    Token bucket per key with bounded memory.
+
+    Buckets are kept in LRU order, the least recently used ones
+    are evicted when there are more than `max_size` of them.
+    """
+
+    def __init__(self, rate: float, burst: int, max_size: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.max_size = max_size
+        # key -> [tokens, updated_at]
+        self._buckets: tp.OrderedDict[int, tp.List[float]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def take(self, key: int, now: float) -> bool:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [self.burst, now]
+            if len(self._buckets) > self.max_size:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            tokens = bucket[0] + (now - bucket[1]) * self.rate
+            bucket[0] = min(tokens, self.burst)
+            bucket[1] = now
+        if bucket[0] < 1:
+            return False
+        bucket[0] -= 1
+        return True
+
+
+class FloodControlMiddleware(BaseMiddleware):
+    """
+    Drops updates of chats and users that exceed their rate.
+
+    Dropped updates don't reach handlers (and DB). A chat gets at most
+    one notice per `flood_notice_window` instead of a reply to every
+    dropped message. Drops are counted in `UpdateStatsMiddleware`.
+
+    Inline and callback queries come at typing speed, so they take
+    tokens from a separate per-user bucket: suggestions typed before
+    a message must not use up the budget of the message itself.
+    """
+
+    def __init__(
+        self,
+        config: FloodConfig,
+        stats: UpdateStatsMiddleware,
+    ) -> None:
+        super().__init__()
+        self.notice_window = config.flood_notice_window
+        self.stats = stats
+        self._chats = TokenBuckets(
+            config.flood_chat_rate,
+            config.flood_chat_burst,
+            config.flood_max_buckets,
+        )
+        self._users = TokenBuckets(
+            config.flood_user_rate,
+            config.flood_user_burst,
+            config.flood_max_buckets,
+        )
+        self._queries = TokenBuckets(
+            config.flood_query_rate,
+            config.flood_query_burst,
+            config.flood_max_buckets,
+        )
+        self._max_noticed = config.flood_max_buckets
+        # chat id -> time of the last notice
+        self._noticed: tp.OrderedDict[int, float] = OrderedDict()
+
+    def _get_drop_reason(
+        self,
+        update: tt.Update,
+        now: float,
+    ) -> tp.Optional[str]:
+        if update.message:
+            message = update.message
+            user = message.from_user
+            if user is not None and not self._users.take(user.id, now):
+                return "user"
+            if not self._chats.take(message.chat.id, now):
+                return "chat"
+            return None
+
+        query = update.inline_query or update.callback_query
+        if query and not self._queries.take(query.from_user.id, now):
+            return "query"
+        return None
+
+    async def on_pre_process_update(self, update: tt.Update, data: dict):
+        now = time.monotonic()
+        reason = self._get_drop_reason(update, now)
+        if reason is None:
+            return
+
+        self.stats.on_dropped(reason)
+        if update.message:
+            await self._notify(update.message, now)
+        raise CancelHandler()
+
+    async def _notify(self, message: tt.Message, now: float) -> None:
+        chat_id = message.chat.id
+        noticed_at = self._noticed.get(chat_id)
+        if noticed_at is not None and now - noticed_at < self.notice_window:
+            return
+        self._noticed[chat_id] = now
+        self._noticed.move_to_end(chat_id)
+        if len(self._noticed) > self._max_noticed:
+            self._noticed.popitem(last=False)
+
+        app_logger.warning("Flood: dropping updates of chat %s", chat_id)
+        try:
+            await message.answer(FLOOD_NOTICE)
+        except Exception:  # pylint: disable=broad-except
+            app_logger.exception("Failed to send flood notice")
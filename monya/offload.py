@@ -0,0 +1,90 @@
+import asyncio
+import typing as tp
+from concurrent.futures import Executor, ProcessPoolExecutor
+from functools import partial
+
+from .log import app_logger
+from .settings import OffloadConfig
+
+T = tp.TypeVar("T")
+
+
+class Offloader:
+    """
+    Runs rendering of big data out of the event loop.
+
+    Calls on data smaller than `offload_threshold` items run inline:
+    for them a trip to a worker costs more than the call itself.
+    Bigger ones go to the loop's default thread executor or,
+    with `offload_use_processes`, to a process pool. Processes avoid
+    the GIL for pure-CPU work, but functions and their arguments
+    must be picklable (module-level functions and plain data).
+    """
+
+    def __init__(self, config: OffloadConfig) -> None:
+        self.threshold = config.offload_threshold
+        self.use_processes = config.offload_use_processes
+        self.n_processes = config.offload_processes
+        self._executor: tp.Optional[Executor] = None
+
+    async def setup(self) -> None:
+        if self.use_processes:
+            self._executor = ProcessPoolExecutor(self.n_processes)
+        app_logger.info("Offloader initialized")
+
+    async def cleanup(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        app_logger.info("Offloader shutdown")
+
+    async def run(
+        self,
+        func: tp.Callable[..., T],
+        *args: tp.Any,
+        size: int,
+    ) -> T:
+        """`size` is the number of items `func` has to process"""
+        if size < self.threshold:
+            return func(*args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args))
+
+
+class LoopLagMonitor:
+    """
+    Reports when the event loop is blocked longer than the budget.
+
+    A timer is scheduled every `loop_lag_interval` seconds, the delay
+    of its wake-up is the time the loop was busy with something else.
+    """
+
+    def __init__(self, config: OffloadConfig) -> None:
+        self.interval = config.loop_lag_interval
+        self.budget = config.loop_lag_budget
+        self._task: tp.Optional[asyncio.Task] = None
+
+    async def setup(self) -> None:
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        app_logger.info("Loop lag monitor initialized")
+
+    async def cleanup(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        app_logger.info("Loop lag monitor shutdown")
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected_at = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = loop.time() - expected_at
+            if lag > self.budget:
+                app_logger.warning(
+                    "Event loop was blocked for %.0f ms (budget %.0f ms)",
+                    lag * 1000,
+                    self.budget * 1000,
+                )
@@ -0,0 +1,243 @@
+import asyncio
+import math
+import time
+import typing as tp
+
+from asyncpg import Record
+from asyncpg.connection import Connection
+from asyncpg.pool import Pool, PoolAcquireContext
+from pydantic import BaseModel
+
+from .log import app_logger
+from .settings import PoolManagerConfig
+
+WARM_UP_TIMEOUT = 5
+
+
+class PoolStats:
+    """Acquire wait times and pool usage since the last window reset"""
+
+    def __init__(self, wait_threshold: float) -> None:
+        self.wait_threshold = wait_threshold
+        self.in_use = 0
+        self.reset_window()
+
+    def reset_window(self) -> None:
+        self.peak_in_use = self.in_use
+        self.n_acquires = 0
+        self.n_waited = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def on_acquired(self, wait: float) -> None:
+        self.in_use += 1
+        self.peak_in_use = max(self.peak_in_use, self.in_use)
+        self.n_acquires += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+        if wait >= self.wait_threshold:
+            self.n_waited += 1
+
+    def on_released(self) -> None:
+        self.in_use -= 1
+
+
+class InstrumentedAcquireContext(PoolAcquireContext):
+    __slots__ = ()
+
+    async def __aenter__(self) -> Connection:
+        started_at = time.monotonic()
+        connection = await super().__aenter__()
+        self.pool.stats.on_acquired(time.monotonic() - started_at)
+        return connection
+
+    async def __aexit__(self, *exc_info: tp.Any) -> None:
+        try:
+            await super().__aexit__(*exc_info)
+        finally:
+            self.pool.stats.on_released()
+
+
+class InstrumentedPool(Pool):
+    """
+    Pool that measures how long `async with pool.acquire()` waits.
+
+    Query methods of the pool (`fetch`, `execute`, ...) acquire
+    connections the same way, so they are measured too.
+    """
+
+    def __init__(
+        self,
+        *connect_args: tp.Any,
+        wait_threshold: float,
+        **kwargs: tp.Any,
+    ) -> None:
+        self.stats = PoolStats(wait_threshold)
+        super().__init__(*connect_args, **kwargs)
+
+    def acquire(self, *, timeout: tp.Optional[float] = None):
+        return InstrumentedAcquireContext(self, timeout)
+
+    def acquire_untracked(self, *, timeout: tp.Optional[float] = None):
+        return PoolAcquireContext(self, timeout)
+
+
+def create_instrumented_pool(
+    dsn: str,
+    wait_threshold: float,
+    **kwargs: tp.Any,
+) -> InstrumentedPool:
+    """Same as `asyncpg.create_pool`, but creates `InstrumentedPool`"""
+    return InstrumentedPool(
+        dsn,
+        wait_threshold=wait_threshold,
+        connection_class=Connection,
+        record_class=Record,
+        setup=None,
+        init=None,
+        loop=None,
+        **kwargs,
+    )
+
+
+class PoolManager(BaseModel):
+    """
+    Keeps a warm floor of pool connections sized from recent load.
+
+    Every `pool_window` seconds the floor is set to the peak number
+    of connections in use during the window. It grows at once,
+    but shrinks (at most by half) only after `pool_shrink_windows`
+    windows in a row with lower load. Connections up to the floor are
+    opened in advance, so requests after idle periods don't pay
+    connection setup; a warm-up holds only a share of free connections,
+    so it doesn't make handlers wait. Windows in which requests waited
+    for the pool are logged.
+    """
+
+    pool: InstrumentedPool
+    max_size: int
+    config: PoolManagerConfig
+
+    floor: int = 0
+    _task: tp.Optional[asyncio.Task] = None
+    _n_low_windows: int = 0
+
+    class Config:
+        arbitrary_types_allowed = True
+        underscore_attrs_are_private = True
+
+    async def setup(self) -> None:
+        self.floor = self.config.pool_floor_min
+        await self._warm_up()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        app_logger.info("Pool manager initialized")
+
+    async def cleanup(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        app_logger.info("Pool manager shutdown")
+
+    def get_stats(self) -> tp.Dict[str, tp.Any]:
+        stats = self.pool.stats
+        return {
+            "floor": self.floor,
+            "max_size": self.max_size,
+            "in_use": stats.in_use,
+            "peak_in_use": stats.peak_in_use,
+            "utilization": stats.peak_in_use / self.max_size,
+            "n_acquires": stats.n_acquires,
+            "n_waited": stats.n_waited,
+            "wait_avg": stats.wait_total / max(stats.n_acquires, 1),
+            "wait_max": stats.wait_max,
+        }
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.config.pool_window)
+            try:
+                self._on_window_end()
+                await self._warm_up()
+            except Exception:  # pylint: disable=broad-except
+                app_logger.exception("Pool manager failed")
+
+    def _on_window_end(self) -> None:
+        stats = self.get_stats()
+        if stats["n_waited"]:
+            app_logger.warning(
+                "Pool: %s of %s acquires waited (avg %.0f ms, max %.0f ms), "
+                "peak in use %s/%s",
+                stats["n_waited"],
+                stats["n_acquires"],
+                stats["wait_avg"] * 1000,
+                stats["wait_max"] * 1000,
+                stats["peak_in_use"],
+                self.max_size,
+            )
+        self.pool.stats.reset_window()
+        self.floor = self._next_floor(stats["peak_in_use"])
+
+    def _next_floor(self, peak_in_use: int) -> int:
+        target = min(
+            max(peak_in_use, self.config.pool_floor_min),
+            self.max_size,
+        )
+        if target > self.floor:
+            self._n_low_windows = 0
+            app_logger.info("Pool floor grows: %s -> %s", self.floor, target)
+            return target
+
+        if target < self.floor:
+            self._n_low_windows += 1
+            if self._n_low_windows >= self.config.pool_shrink_windows:
+                self._n_low_windows = 0
+                floor = max(target, math.ceil(self.floor / 2))
+                app_logger.info(
+                    "Pool floor shrinks: %s -> %s",
+                    self.floor,
+                    floor,
+                )
+                return floor
+        else:
+            self._n_low_windows = 0
+        return self.floor
+
+    def _get_warm_up_size(self) -> int:
+        """
+        Connections to open now: up to the floor, but no more than
+        `pool_warm_up_share` of the free ones and never the last one.
+        The rest is opened by the next windows.
+        """
+        in_use = self.pool.stats.in_use
+        n_free = self.max_size - in_use
+        return max(
+            min(
+                self.floor - in_use,
+                int(n_free * self.config.pool_warm_up_share),
+                n_free - 1,
+            ),
+            0,
+        )
+
+    async def _warm_up(self) -> None:
+        """Open (or keep alive) connections up to the floor"""
+        n_connections = self._get_warm_up_size()
+        if n_connections <= 0:
+            return
+
+        contexts = [
+            self.pool.acquire_untracked(timeout=WARM_UP_TIMEOUT)
+            for _ in range(n_connections)
+        ]
+        results = await asyncio.gather(
+            *(context.__aenter__() for context in contexts),
+            return_exceptions=True,
+        )
+        for context, result in zip(contexts, results):
+            if isinstance(result, BaseException):
+                app_logger.warning("Failed to warm up connection: %r", result)
+            else:
+                await context.__aexit__(None, None, None)
@@ -0,0 +1,96 @@
+import re
+import typing as tp
+
+from aiogram import types as tt
+
+Handler = tp.Callable[..., tp.Awaitable[None]]
+ArgsParser = tp.Callable[[str], tp.Dict[str, tp.Any]]
+
+COMMAND_RE = re.compile(r"^/(\w+)(?:@(\w+))?(?:\s+(.*))?$", flags=re.DOTALL)
+
+
+class Route(tp.NamedTuple):
+    handler: Handler
+    parse: tp.Optional[ArgsParser]
+
+
+class MessageRouter:
+    """
+    Picks the handler of a text message in one pass.
+
+    Replaces a chain of aiogram filters that are checked one
+    after another for every message. Commands are found by a dict
+    lookup, then operations regexp and bot mention are checked.
+    Arguments are parsed once here and passed to the handler
+    as keyword arguments.
+    """
+
+    def __init__(self, bot_name: str) -> None:
+        self.bot_name = bot_name.lower()
+        self._mention = f"@{self.bot_name}"
+        self._commands: tp.Dict[str, Route] = {}
+        self._operations: tp.Optional[tp.Tuple[tp.Pattern, Route]] = None
+        self._mention_route: tp.Optional[Route] = None
+
+    def add_command(
+        self,
+        command: str,
+        handler: Handler,
+        parse: tp.Optional[ArgsParser] = None,
+    ) -> None:
+        """`parse` gets the text after the command"""
+        self._commands[command.lower()] = Route(handler, parse)
+
+    def set_operations_route(
+        self,
+        regexp: str,
+        handler: Handler,
+        parse: tp.Optional[ArgsParser] = None,
+    ) -> None:
+        """
+        For messages with a line matching `regexp`, `parse` gets
+        the whole text
+        """
+        self._operations = (
+            re.compile(regexp, flags=re.IGNORECASE | re.MULTILINE),
+            Route(handler, parse),
+        )
+
+    def set_mention_route(self, handler: Handler) -> None:
+        """For other messages mentioning the bot"""
+        self._mention_route = Route(handler, None)
+
+    @staticmethod
+    def _resolve(
+        route: Route,
+        text: str,
+    ) -> tp.Tuple[Handler, tp.Dict[str, tp.Any]]:
+        kwargs = route.parse(text) if route.parse is not None else {}
+        return route.handler, kwargs
+
+    def route(
+        self,
+        message: tt.Message,
+    ) -> tp.Optional[tp.Tuple[Handler, tp.Dict[str, tp.Any]]]:
+        text = message.text
+        if not text:
+            return None
+
+        if text[0] == "/":
+            match = COMMAND_RE.match(text)
+            if match is not None:
+                command, mention, args = match.groups()
+                command_route = self._commands.get(command.lower())
+                if command_route is not None and (
+                    mention is None or mention.lower() == self.bot_name
+                ):
+                    return self._resolve(command_route, args or "")
+
+        if self._operations is not None:
+            operations_re, route = self._operations
+            if operations_re.search(text):
+                return self._resolve(route, text)
+
+        if self._mention_route is not None and self._mention in text.lower():
+            return self._resolve(self._mention_route, text)
+        return None
@@ -0,0 +1,135 @@
+import asyncio
+import heapq
+import typing as tp
+from uuid import UUID
+
+from .db import DBService
+from .log import app_logger
+from .settings import SchedulerConfig
+
+PERIODS = ("day", "week", "month")
+ERROR_SLEEP = 5
+
+
+class Scheduler:
+    """
+    Runs recurring operations stored in `schedules` table.
+
+    Only runs within `scheduler_horizon` seconds are loaded: into a heap
+    ordered by run time, which is served by a single timer task.
+    The heap is refilled from the `next_run_at` index every half
+    of the horizon, so neither per-schedule tasks nor full table scans
+    are needed. A refill that hit `scheduler_max_loaded` is repeated
+    as soon as the loaded runs are done, so a big backlog of missed runs
+    is not limited to one refill per half of the horizon.
+    Due runs are applied in batches by
+    `DBService.run_schedules`, which skips runs that were already
+    applied, so runs missed during downtime are recovered
+    after a restart without duplicates.
+    """
+
+    def __init__(self, db_service: DBService, config: SchedulerConfig):
+        self.db_service = db_service
+        self.horizon = config.scheduler_horizon
+        self.batch_size = config.scheduler_batch_size
+        self.max_loaded = config.scheduler_max_loaded
+
+        # (loop time, schedule_id, n_runs)
+        self._heap: tp.List[tp.Tuple[float, UUID, int]] = []
+        self._loaded: tp.Dict[UUID, int] = {}
+        self._next_refill_at = 0.0
+        # Last refill loaded `max_loaded` runs, there may be more
+        self._is_truncated = False
+        self._wakeup: tp.Optional[asyncio.Event] = None
+        self._task: tp.Optional[asyncio.Task] = None
+
+    async def setup(self) -> None:
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        app_logger.info("Scheduler initialized")
+
+    async def cleanup(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        app_logger.info("Scheduler shutdown")
+
+    def push(self, schedule_id: UUID, n_runs: int, delay: float) -> None:
+        """Put the next run of the schedule to the heap if it is close"""
+        if delay > self.horizon or self._loaded.get(schedule_id) == n_runs:
+            return
+        if len(self._loaded) >= self.max_loaded:
+            # The rest will be loaded by the next refill
+            return
+        run_at = asyncio.get_running_loop().time() + delay
+        heapq.heappush(self._heap, (run_at, schedule_id, n_runs))
+        self._loaded[schedule_id] = n_runs
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _refill(self) -> None:
+        schedules = await self.db_service.get_upcoming_schedules(
+            self.horizon,
+            self.max_loaded,
+        )
+        for schedule_id, n_runs, delay in schedules:
+            self.push(schedule_id, n_runs, delay)
+        self._is_truncated = len(schedules) >= self.max_loaded
+
+    def _pop_due(self) -> tp.List[tp.Tuple[UUID, int]]:
+        now = asyncio.get_running_loop().time()
+        runs = []
+        while self._heap and self._heap[0][0] <= now:
+            _, schedule_id, n_runs = heapq.heappop(self._heap)
+            if self._loaded.get(schedule_id) == n_runs:
+                del self._loaded[schedule_id]
+                runs.append((schedule_id, n_runs))
+            if len(runs) >= self.batch_size:
+                break
+        return runs
+
+    async def _run_due(self) -> None:
+        runs = self._pop_due()
+        if not runs:
+            return
+        done = await self.db_service.run_schedules(runs)
+        app_logger.info(
+            "Scheduler: %s of %s runs applied",
+            len(done),
+            len(runs),
+        )
+        for schedule_id, n_runs, delay in done:
+            self.push(schedule_id, n_runs, delay)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        assert self._wakeup is not None
+        while True:
+            try:
+                if loop.time() >= self._next_refill_at:
+                    await self._refill()
+                    self._next_refill_at = loop.time() + self.horizon / 2
+                await self._run_due()
+                if self._is_truncated and not self._loaded:
+                    self._next_refill_at = loop.time()
+            except Exception:  # pylint: disable=broad-except
+                app_logger.exception("Scheduler failed")
+                # Popped runs are still due in DB, reload them
+                self._next_refill_at = 0.0
+                await asyncio.sleep(ERROR_SLEEP)
+                continue
+
+            wake_at = self._next_refill_at
+            if self._heap:
+                wake_at = min(wake_at, self._heap[0][0])
+            timeout = wake_at - loop.time()
+            if timeout <= 0:
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
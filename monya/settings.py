@@ -1,4 +1,6 @@
-from pydantic import BaseSettings, PostgresDsn
+import typing as tp
+
+from pydantic import BaseModel, BaseSettings, PostgresDsn
 
 
 class Config(BaseSettings):
@@ -20,9 +22,25 @@ class LogConfig(Config):
         }
 
 
+class BotConfig(BaseModel):
+    bot_token: str
+    bot_name: str
+
+    @property
+    def t_bot_id(self) -> int:
+        return int(self.bot_token.split(":", 1)[0])
+
+
 class TelegramConfig(Config):
     bot_token: str
     bot_name: str
+    # JSON list of {"bot_token": ..., "bot_name": ...}
+    extra_bots: tp.List[BotConfig] = []
+    bot_stats_interval: float = 60
+
+    def get_bots(self) -> tp.List[BotConfig]:
+        bot = BotConfig(bot_token=self.bot_token, bot_name=self.bot_name)
+        return [bot, *self.extra_bots]
 
 
 class DBPoolConfig(Config):
@@ -37,8 +55,70 @@ class DBPoolConfig(Config):
     max_cached_statement_lifetime: int = 3600
 
 
+class PoolManagerConfig(Config):
+    pool_floor_min: int = 1
+    pool_window: float = 30
+    pool_shrink_windows: int = 10
+    pool_wait_threshold: float = 0.05
+    # Share of free connections a warm-up may hold at once,
+    # at least one is always left for handlers
+    pool_warm_up_share: float = 0.5
+
+
 class DBConfig(Config):
     db_pool_config: DBPoolConfig
+    pool_manager_config: PoolManagerConfig
+
+
+class JournalConfig(Config):
+    journal_enabled: bool = False
+    journal_dir: str = "journal"
+    journal_segment_max_size: int = 16 * 1024 * 1024
+    journal_ack_timeout: float = 1
+    journal_retry_interval: float = 1
+    journal_replay_batch_size: int = 100
+    # Ids of applied messages are kept for deduplication of replays
+    # and redelivered updates, Telegram keeps updates for 24 hours
+    journal_applied_ttl: float = 7 * 24 * 3600
+    journal_prune_interval: float = 3600
+
+
+class CatchUpConfig(Config):
+    catchup_enabled: bool = True
+    catchup_min_backlog: int = 100
+    catchup_concurrency: int = 10
+    catchup_retry_interval: float = 1
+    # Attempts to get updates before falling back to polling
+    catchup_max_attempts: int = 5
+
+
+class SchedulerConfig(Config):
+    scheduler_horizon: float = 600
+    scheduler_batch_size: int = 500
+    scheduler_max_loaded: int = 10000
+
+
+class FloodConfig(Config):
+    flood_enabled: bool = True
+    # Tokens per second and bucket size
+    flood_chat_rate: float = 1
+    flood_chat_burst: int = 20
+    flood_user_rate: float = 0.5
+    flood_user_burst: int = 10
+    # Inline and callback queries of a user
+    flood_query_rate: float = 5
+    flood_query_burst: int = 50
+    flood_max_buckets: int = 10000
+    flood_notice_window: float = 60
+
+
+class OffloadConfig(Config):
+    # Number of items (e.g. history rows) to render out of the loop
+    offload_threshold: int = 5000
+    offload_use_processes: bool = False
+    offload_processes: int = 2
+    loop_lag_interval: float = 0.5
+    loop_lag_budget: float = 0.1
 
 
 class ServiceConfig(Config):
@@ -48,11 +128,24 @@ class ServiceConfig(Config):
     log_config: LogConfig
     telegram_config: TelegramConfig
     db_config: DBConfig
+    journal_config: JournalConfig
+    catchup_config: CatchUpConfig
+    scheduler_config: SchedulerConfig
+    flood_config: FloodConfig
+    offload_config: OffloadConfig
 
 
 def get_config() -> ServiceConfig:
     return ServiceConfig(
         log_config=LogConfig(),
         telegram_config=TelegramConfig(),
-        db_config=DBConfig(db_pool_config=DBPoolConfig()),
+        db_config=DBConfig(
+            db_pool_config=DBPoolConfig(),
+            pool_manager_config=PoolManagerConfig(),
+        ),
+        journal_config=JournalConfig(),
+        catchup_config=CatchUpConfig(),
+        scheduler_config=SchedulerConfig(),
+        flood_config=FloodConfig(),
+        offload_config=OffloadConfig(),
     )
@@ -0,0 +1,202 @@
+import bisect
+import re
+import time
+import typing as tp
+from collections import Counter, OrderedDict, defaultdict, deque
+
+from .db import DBService
+
+Operation = tp.Tuple[str, float, str]
+
+OPS = ("pay", "spend")
+MAX_CHATS = 10_000
+MAX_USERS = 100_000
+CHAT_TTL = 600
+RECENT_OPERATIONS_LIMIT = 500
+RECENT_PER_NAME = 5
+MAX_COMMENTS = 200
+MAX_ENTRIES = 20
+# The same amount format as in operation messages
+AMOUNT_PATTERN = r"\d+(?:[.,]\d+)?"
+AMOUNT_RE = re.compile(AMOUNT_PATTERN)
+
+
+def format_amount(amount: float) -> str:
+    return f"{abs(amount):.2f}".rstrip("0").rstrip(".")
+
+
+def parse_amount(amount_str: str) -> tp.Optional[float]:
+    if not AMOUNT_RE.fullmatch(amount_str):
+        return None
+    amount = float(amount_str.replace(",", "."))
+    return amount if amount > 0 else None
+
+
+class ChatSuggestions:
+    """
+    Names and recent comments of one chat in sorted arrays.
+
+    Prefix search is done with bisect, so it needs no DB queries.
+    """
+
+    def __init__(
+        self,
+        names: tp.Iterable[str],
+        recent_operations: tp.Sequence[Operation],
+    ) -> None:
+        self.loaded_at = time.monotonic()
+        self._names = sorted(names, key=str.casefold)
+        self._name_keys = [name.casefold() for name in self._names]
+        self._recent: tp.DefaultDict[
+            str, tp.Deque[tp.Tuple[float, str]]
+        ] = defaultdict(lambda: deque(maxlen=RECENT_PER_NAME))
+        self._comment_counts: tp.Counter[str] = Counter()
+        self._comments: tp.List[str] = []
+        self._comment_keys: tp.List[str] = []
+        # Operations come newest first
+        self.add_operations(list(reversed(recent_operations)))
+
+    def add_name(self, name: str) -> None:
+        key = name.casefold()
+        i = bisect.bisect_left(self._name_keys, key)
+        self._name_keys.insert(i, key)
+        self._names.insert(i, name)
+
+    def remove_name(self, name: str) -> None:
+        if name in self._names:
+            i = self._names.index(name)
+            del self._names[i]
+            del self._name_keys[i]
+        self._recent.pop(name, None)
+
+    def add_operations(self, operations: tp.Sequence[Operation]) -> None:
+        for name, amount, comment in operations:
+            self._recent[name].appendleft((amount, comment))
+            if comment:
+                self._comment_counts[comment] += 1
+        if len(self._comment_counts) > MAX_COMMENTS:
+            self._comment_counts = Counter(
+                dict(self._comment_counts.most_common(MAX_COMMENTS))
+            )
+        self._comments = sorted(self._comment_counts, key=str.casefold)
+        self._comment_keys = [c.casefold() for c in self._comments]
+
+    @staticmethod
+    def _prefix_range(keys: tp.List[str], prefix: str) -> range:
+        prefix = prefix.casefold()
+        start = bisect.bisect_left(keys, prefix)
+        end = bisect.bisect_left(keys, prefix + "\U0010ffff", lo=start)
+        return range(start, end)
+
+    def match_names(self, prefix: str) -> tp.List[str]:
+        return [
+            self._names[i]
+            for i in self._prefix_range(self._name_keys, prefix)
+        ]
+
+    def match_comments(self, prefix: str, limit: int) -> tp.List[str]:
+        comments = [
+            self._comments[i]
+            for i in self._prefix_range(self._comment_keys, prefix)
+        ]
+        comments.sort(key=lambda c: -self._comment_counts[c])
+        return comments[:limit]
+
+    def get_recent(self, name: str) -> tp.List[tp.Tuple[float, str]]:
+        return list(self._recent.get(name, ()))
+
+
+class SuggestIndex:
+    """
+    Per-chat suggestions for inline queries.
+
+    Inline queries don't tell the chat they are typed in, so the chat
+    is taken from the last message of the user that the bot has seen.
+    Both chats and users are kept in LRU order and their number
+    is bounded. Chats are loaded from DB on first use and reloaded
+    after `CHAT_TTL` seconds.
+    """
+
+    def __init__(self) -> None:
+        self._chats: tp.OrderedDict[int, ChatSuggestions] = OrderedDict()
+        self._user_chats: tp.OrderedDict[int, int] = OrderedDict()
+
+    def remember_user_chat(self, t_user_id: int, t_chat_id: int) -> None:
+        self._user_chats[t_user_id] = t_chat_id
+        self._user_chats.move_to_end(t_user_id)
+        if len(self._user_chats) > MAX_USERS:
+            self._user_chats.popitem(last=False)
+
+    def get_user_chat(self, t_user_id: int) -> tp.Optional[int]:
+        return self._user_chats.get(t_user_id)
+
+    def get_loaded(self, t_chat_id: int) -> tp.Optional[ChatSuggestions]:
+        return self._chats.get(t_chat_id)
+
+    async def get_chat(
+        self,
+        t_chat_id: int,
+        db_service: DBService,
+    ) -> ChatSuggestions:
+        chat = self._chats.get(t_chat_id)
+        if chat is None or time.monotonic() - chat.loaded_at > CHAT_TTL:
+            names = await db_service.get_chat_users(t_chat_id)
+            recent_operations = await db_service.get_recent_operations(
+                t_chat_id,
+                RECENT_OPERATIONS_LIMIT,
+            )
+            chat = self._chats[t_chat_id] = ChatSuggestions(
+                names,
+                recent_operations,
+            )
+        self._chats.move_to_end(t_chat_id)
+        if len(self._chats) > MAX_CHATS:
+            self._chats.popitem(last=False)
+        return chat
+
+
+def make_inline_entries(chat: ChatSuggestions, query: str) -> tp.List[str]:
+    """
+    Ready-to-send 'pay|spend Name amount comment' entries for a query.
+
+    The query is a prefix of such an entry. Without an amount recent
+    operations of matching names are suggested, with an amount -
+    recent comments matching the typed beginning of the comment.
+    A typed name is completed unless it is a name itself, so names
+    without recent operations are suggested once an amount is typed:
+    every entry must be a valid operation message.
+    """
+    parts = query.split(maxsplit=3)
+    is_last_complete = query.endswith(" ")
+
+    op_prefix = parts[0].lower() if parts else ""
+    ops = [op for op in OPS if op.startswith(op_prefix)]
+
+    name_prefix = parts[1] if len(parts) > 1 else ""
+    names = chat.match_names(name_prefix)
+    if len(parts) > 2 or len(parts) == 2 and is_last_complete:
+        names = [name for name in names if name == name_prefix] or names
+
+    entries: tp.List[str] = []
+    if len(parts) < 3:
+        for name in names:
+            recent = chat.get_recent(name)
+            for op in ops:
+                entries.extend(
+                    f"{op} {name} {format_amount(amount)} {comment}"
+                    for amount, comment in recent
+                    if ("spend" if amount < 0 else "pay") == op
+                )
+        return list(dict.fromkeys(e.strip() for e in entries))[:MAX_ENTRIES]
+
+    amount_str = parts[2]
+    if parse_amount(amount_str) is None:
+        return []
+    comment_prefix = parts[3].strip() if len(parts) > 3 else ""
+    comments = [comment_prefix]
+    comments += chat.match_comments(comment_prefix, MAX_ENTRIES)
+    for op in ops:
+        for name in names:
+            for comment in comments:
+                entries.append(f"{op} {name} {amount_str} {comment}")
+    return list(dict.fromkeys(e.strip() for e in entries))[:MAX_ENTRIES]
@@ -0,0 +1,271 @@
+import time
+import typing as tp
+from datetime import datetime, timedelta
+
+from asyncpg import Pool, create_pool
+
+from monya.db import ChatAlreadyExistsError, DBService
+from monya.handlers import FIND_PAGE_SIZE
+from monya.settings import SchedulerConfig
+from monya.suggest import RECENT_OPERATIONS_LIMIT
+
+from .data import NAMES, make_chat_history
+from .timing import get_repeat, measure_async
+
+# Bench chats get ids that real Telegram chats and bots can't have
+BASE_T_CHAT_ID = -1_000_000_000
+NEW_T_CHAT_ID = BASE_T_CHAT_ID + 1
+T_BOT_ID = -1
+N_SCHEDULES = 100
+FIND_PAGE = 10
+SCHEDULER_CONFIG = SchedulerConfig()
+
+
+def get_t_chat_id(size: int) -> int:
+    return BASE_T_CHAT_ID - size
+
+
+async def seed_chat(pool: Pool, t_chat_id: int, size: int) -> None:
+    history = make_chat_history(size)
+    now = datetime.now()
+    async with pool.acquire() as conn, conn.transaction():
+        await conn.execute(
+            "DELETE FROM chats WHERE t_bot_id = $1 AND t_chat_id = $2",
+            T_BOT_ID,
+            t_chat_id,
+        )
+        chat_id = await conn.fetchval(
+            """
+                INSERT INTO chats (t_bot_id, t_chat_id)
+                VALUES ($1, $2)
+                RETURNING chat_id
+            """,
+            T_BOT_ID,
+            t_chat_id,
+        )
+        user_ids = {}
+        for name in NAMES:
+            user_ids[name] = await conn.fetchval(
+                """
+                    INSERT INTO users (chat_id, name)
+                    VALUES ($1, $2)
+                    RETURNING user_id
+                """,
+                chat_id,
+                name,
+            )
+        # Spread operations over the last year
+        step = timedelta(days=365) / size
+        records = [
+            (
+                chat_id,
+                user_ids[name],
+                amount,
+                comment,
+                now - step * (size - i),
+            )
+            for i, (name, amount, comment) in enumerate(history)
+        ]
+        await conn.copy_records_to_table(
+            "actions",
+            records=records,
+            columns=["chat_id", "user_id", "amount", "comment", "added_at"],
+        )
+
+
+async def seed_schedules(db_service: DBService, t_chat_id: int) -> None:
+    for i in range(N_SCHEDULES):
+        await db_service.add_schedule(
+            t_chat_id,
+            NAMES[i % len(NAMES)],
+            -100,
+            "#подписка",
+            "month",
+        )
+
+
+async def cleanup_chats(pool: Pool, sizes: tp.Sequence[int]) -> None:
+    await pool.execute(
+        """
+            DELETE FROM chats
+            WHERE t_bot_id = $1 AND t_chat_id = ANY($2::BIGINT[])
+        """,
+        T_BOT_ID,
+        [NEW_T_CHAT_ID, *(get_t_chat_id(size) for size in sizes)],
+    )
+
+
+async def measure_run_schedules(
+    db_service: DBService,
+    t_chat_id: int,
+    size: int,
+) -> float:
+    """`N_SCHEDULES` due runs per call, new schedules for every repeat"""
+    timings = []
+    for _ in range(get_repeat(size)):
+        runs = []
+        for _ in range(N_SCHEDULES):
+            schedule_id = await db_service.add_schedule(
+                t_chat_id,
+                NAMES[0],
+                -100,
+                "#подписка",
+                "day",
+            )
+            runs.append((schedule_id, 0))
+        started_at = time.perf_counter()
+        await db_service.run_schedules(runs)
+        timings.append(time.perf_counter() - started_at)
+        for schedule_id, _ in runs:
+            await db_service.delete_schedule(schedule_id)
+    return min(timings)
+
+
+async def measure_reset(
+    pool: Pool,
+    db_service: DBService,
+    t_chat_id: int,
+    size: int,
+) -> float:
+    """The chat is seeded again before every repeat"""
+    timings = []
+    for _ in range(get_repeat(size)):
+        await seed_chat(pool, t_chat_id, size)
+        await db_service.rebuild_totals(t_chat_id)
+        started_at = time.perf_counter()
+        await db_service.reset(t_chat_id)
+        timings.append(time.perf_counter() - started_at)
+    return min(timings)
+
+
+async def run(db_url: str, sizes: tp.Sequence[int]) -> tp.Dict[str, float]:
+    pool = create_pool(db_url, min_size=1, max_size=2)
+    db_service = DBService(pool=pool, t_bot_id=T_BOT_ID)
+    await db_service.setup()
+
+    results = {}
+    try:
+        results["db.ping"] = await measure_async(db_service.ping, 1)
+
+        async def add_and_delete_chat() -> None:
+            await db_service.add_chat(NEW_T_CHAT_ID)
+            await cleanup_chats(pool, [])
+
+        results["db.add_delete_chat"] = await measure_async(
+            add_and_delete_chat,
+            1,
+        )
+        for size in sizes:
+            t_chat_id = get_t_chat_id(size)
+            await seed_chat(pool, t_chat_id, size)
+            await db_service.rebuild_totals(t_chat_id)
+            await seed_schedules(db_service, t_chat_id)
+            await pool.execute("ANALYZE")
+
+            async def add_existing_chat() -> None:
+                # Done before every write
+                try:
+                    await db_service.add_chat(t_chat_id)
+                except ChatAlreadyExistsError:
+                    pass
+
+            async def add_and_delete_user() -> None:
+                await db_service.add_user(t_chat_id, "Новенький")
+                await db_service.delete_user(t_chat_id, "Новенький")
+
+            async def add_and_delete_schedule() -> None:
+                schedule_id = await db_service.add_schedule(
+                    t_chat_id,
+                    NAMES[0],
+                    -100,
+                    "#подписка",
+                    "week",
+                )
+                await db_service.delete_schedule(schedule_id)
+
+            benches = {
+                "add_chat_existing": add_existing_chat,
+                "get_chat_users": lambda: db_service.get_chat_users(
+                    t_chat_id,
+                ),
+                "get_chat_operations": lambda: db_service.get_chat_operations(
+                    t_chat_id,
+                ),
+                "get_user_operations": lambda: db_service.get_user_operations(
+                    t_chat_id,
+                    NAMES[0],
+                ),
+                "get_recent_operations": (
+                    lambda: db_service.get_recent_operations(
+                        t_chat_id,
+                        RECENT_OPERATIONS_LIMIT,
+                    )
+                ),
+                "get_period_totals": lambda: db_service.get_period_totals(
+                    t_chat_id,
+                    "month",
+                    3,
+                ),
+                "get_top_categories": lambda: db_service.get_top_categories(
+                    t_chat_id,
+                    "month",
+                    3,
+                    5,
+                ),
+                "add_operation": lambda: db_service.add_operation(
+                    t_chat_id,
+                    NAMES[0],
+                    -100,
+                    "такси",
+                ),
+                "add_operations[15]": lambda: db_service.add_operations(
+                    t_chat_id,
+                    [(name, -100, "#еда") for name in NAMES[:3]] * 5,
+                ),
+                "find_operations": lambda: db_service.find_operations(
+                    t_chat_id,
+                    "такси",
+                    FIND_PAGE_SIZE,
+                    0,
+                ),
+                "find_operations_page": lambda: db_service.find_operations(
+                    t_chat_id,
+                    "такси",
+                    FIND_PAGE_SIZE,
+                    FIND_PAGE * FIND_PAGE_SIZE,
+                ),
+                "add_delete_user": add_and_delete_user,
+                "add_delete_schedule": add_and_delete_schedule,
+                "get_chat_schedules": lambda: db_service.get_chat_schedules(
+                    t_chat_id,
+                ),
+                "get_upcoming_schedules": (
+                    lambda: db_service.get_upcoming_schedules(
+                        SCHEDULER_CONFIG.scheduler_horizon,
+                        SCHEDULER_CONFIG.scheduler_max_loaded,
+                    )
+                ),
+                "rebuild_totals": lambda: db_service.rebuild_totals(
+                    t_chat_id,
+                ),
+            }
+            for name, bench in benches.items():
+                results[f"db.{name}[{size}]"] = await measure_async(
+                    bench,
+                    size,
+                )
+            results[f"db.run_schedules[{size}]"] = (
+                await measure_run_schedules(db_service, t_chat_id, size)
+            )
+            # Destroys the history, so goes last
+            results[f"db.reset[{size}]"] = await measure_reset(
+                pool,
+                db_service,
+                t_chat_id,
+                size,
+            )
+    finally:
+        await cleanup_chats(pool, sizes)
+        await db_service.cleanup()
+        await pool.close()
+    return results
@@ -0,0 +1,41 @@
+import typing as tp
+
+from monya.handlers import (
+    calc_grouped_amounts,
+    format_chat_history,
+    format_status_reply,
+    format_user_history,
+)
+
+from .data import make_chat_history, make_user_history
+from .timing import measure
+
+
+def run(sizes: tp.Sequence[int]) -> tp.Dict[str, float]:
+    results = {}
+    for size in sizes:
+        chat_history = make_chat_history(size)
+        user_history = make_user_history(size)
+        # One status row per history row to make the reply size grow
+        statuses = {
+            f"{name}{i}": amount
+            for i, (name, amount, _) in enumerate(chat_history)
+        }
+
+        results[f"handlers.calc_grouped_amounts[{size}]"] = measure(
+            lambda: calc_grouped_amounts(chat_history),
+            size,
+        )
+        results[f"handlers.format_status_reply[{size}]"] = measure(
+            lambda: format_status_reply(statuses),
+            size,
+        )
+        results[f"handlers.format_chat_history[{size}]"] = measure(
+            lambda: format_chat_history(chat_history),
+            size,
+        )
+        results[f"handlers.format_user_history[{size}]"] = measure(
+            lambda: format_user_history("Вася", user_history),
+            size,
+        )
+    return results
@@ -0,0 +1,135 @@
+import typing as tp
+
+from aiogram import Bot, Dispatcher
+from aiogram import types as tt
+
+from monya.handlers import (
+    make_spend_pay_regexp,
+    parse_args,
+    parse_name,
+    parse_operations_message,
+)
+from monya.router import MessageRouter
+
+from .timing import measure, measure_async
+
+BOT_NAME = "monya_bot"
+# Token format is checked, but no requests are made
+BOT_TOKEN = "123456:bench"
+N_MESSAGES = 1000
+
+TEXTS = [
+    "/add Вася",
+    f"@{BOT_NAME} pay Вася 1500 продукты #еда",
+    "/status",
+    "просто болтовня в чате",
+    f"@{BOT_NAME} spend Петя 350,5 такси\nspend Маша 200 кафе",
+    "/find такси",
+    f"@{BOT_NAME} как дела?",
+    "/report week",
+    "/history",
+]
+# Order of handlers in `add_handlers` before `MessageRouter`
+LEGACY_COMMANDS_BEFORE = [
+    "start", "help", "reset", "add", "delete", "users", "pay", "spend",
+]
+LEGACY_COMMANDS_AFTER = ["history", "status", "report", "every", "find"]
+ARGS_PARSERS = {
+    "reset": parse_args,
+    "add": parse_name,
+    "delete": parse_name,
+    "report": parse_args,
+    "every": parse_args,
+    "find": parse_args,
+}
+
+
+async def noop(*args: tp.Any, **kwargs: tp.Any) -> None:
+    pass
+
+
+def make_updates(n: int) -> tp.List[tt.Update]:
+    return [
+        tt.Update(
+            update_id=i,
+            message={
+                "message_id": i,
+                "date": 0,
+                "chat": {"id": -1, "type": "group"},
+                "from": {"id": 1, "is_bot": False, "first_name": "Вася"},
+                "text": TEXTS[i % len(TEXTS)],
+            },
+        )
+        for i in range(n)
+    ]
+
+
+def make_legacy_dispatcher(bot: Bot) -> Dispatcher:
+    dp = Dispatcher(bot)
+    for command in LEGACY_COMMANDS_BEFORE:
+        dp.register_message_handler(noop, commands={command})
+    dp.register_message_handler(
+        noop,
+        regexp=make_spend_pay_regexp(BOT_NAME),
+    )
+    for command in LEGACY_COMMANDS_AFTER:
+        dp.register_message_handler(noop, commands={command})
+    dp.register_message_handler(noop, regexp=fr"@{BOT_NAME}")
+    return dp
+
+
+def make_router() -> MessageRouter:
+    """Same routes as `monya.handlers.make_router`, but with no-op handlers"""
+    router = MessageRouter(BOT_NAME)
+    for command in LEGACY_COMMANDS_BEFORE + LEGACY_COMMANDS_AFTER:
+        router.add_command(command, noop, ARGS_PARSERS.get(command))
+    router.set_operations_route(
+        make_spend_pay_regexp(BOT_NAME),
+        noop,
+        parse_operations_message,
+    )
+    router.set_mention_route(noop)
+    return router
+
+
+def make_routed_dispatcher(bot: Bot, router: MessageRouter) -> Dispatcher:
+    dp = Dispatcher(bot)
+
+    async def handle_routed(message: tt.Message) -> None:
+        route = router.route(message)
+        if route is not None:
+            handler, kwargs = route
+            await handler(message, **kwargs)
+
+    dp.register_message_handler(handle_routed)
+    return dp
+
+
+async def run() -> tp.Dict[str, float]:
+    """Dispatching of a mix of messages: filter chain vs `MessageRouter`"""
+    bot = Bot(token=BOT_TOKEN)
+    router = make_router()
+    legacy_dp = make_legacy_dispatcher(bot)
+    routed_dp = make_routed_dispatcher(bot, router)
+    updates = make_updates(N_MESSAGES)
+    messages = [update.message for update in updates]
+
+    async def process(dp: Dispatcher) -> None:
+        for update in updates:
+            await dp.process_update(update)
+
+    def route() -> None:
+        for message in messages:
+            router.route(message)
+
+    return {
+        f"router.filter_chain[{N_MESSAGES}]": await measure_async(
+            lambda: process(legacy_dp),
+            N_MESSAGES,
+        ),
+        f"router.routed_dispatcher[{N_MESSAGES}]": await measure_async(
+            lambda: process(routed_dp),
+            N_MESSAGES,
+        ),
+        f"router.route[{N_MESSAGES}]": measure(route, N_MESSAGES),
+    }
@@ -0,0 +1,33 @@
+import random
+import typing as tp
+
+NAMES = [
+    "Вася", "Петя", "Маша", "Оля", "Коля",
+    "Дима", "Катя", "Саша", "Женя", "Лена",
+]
+COMMENTS = [
+    "", "такси", "продукты #еда", "бензин", "кафе #еда",
+    "билеты #дорога", "аренда", "пиво", "подарок", "#дорога метро",
+]
+
+
+def make_chat_history(
+    size: int,
+    seed: int = 0,
+) -> tp.List[tp.Tuple[str, float, str]]:
+    rnd = random.Random(seed)
+    return [
+        (
+            rnd.choice(NAMES),
+            float(rnd.randint(-5000, 5000)),
+            rnd.choice(COMMENTS),
+        )
+        for _ in range(size)
+    ]
+
+
+def make_user_history(
+    size: int,
+    seed: int = 0,
+) -> tp.List[tp.Tuple[float, str]]:
+    return [(am, cm) for _, am, cm in make_chat_history(size, seed)]
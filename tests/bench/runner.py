@@ -0,0 +1,143 @@
+"""
+Micro-benchmarks of hot functions and DB queries.
+
+Usage:
+    python -m tests.bench [--update] [--tolerance 0.2] [--rounds 1]
+        [--sizes 1000,10000]
+
+DB benchmarks run only if BENCH_DB_URL points to a migrated database.
+Best time of several runs is taken for every metric and compared with
+`baselines.json`; the exit code is 1 if any metric is slower than its
+baseline by more than the tolerance or has no baseline at all.
+
+`--update` records baselines. The whole suite is run `--rounds` times:
+the gate takes the fastest round of every metric, baselines take
+the slowest one, so that noise of the machine doesn't fail the gate.
+Baselines depend on the machine: the committed ones are recorded
+on the reference machine (see README), the one that runs `make bench`.
+"""
+import argparse
+import asyncio
+import os
+import typing as tp
+from pathlib import Path
+
+import orjson
+
+from . import bench_db, bench_handlers, bench_router
+
+BASELINES_PATH = Path(__file__).parent / "baselines.json"
+DEFAULT_SIZES = (10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6)
+DEFAULT_TOLERANCE = 0.2
+# Differences smaller than that are considered noise
+MIN_DELTA = 0.0005
+
+
+def load_baselines() -> tp.Optional[tp.Dict[str, float]]:
+    if not BASELINES_PATH.exists():
+        return None
+    return orjson.loads(BASELINES_PATH.read_bytes())
+
+
+def save_baselines(baselines: tp.Dict[str, float]) -> None:
+    data = orjson.dumps(
+        baselines,
+        option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS,
+    )
+    BASELINES_PATH.write_bytes(data + b"\n")
+
+
+def compare(
+    results: tp.Dict[str, float],
+    baselines: tp.Dict[str, float],
+    tolerance: float,
+) -> tp.Tuple[tp.List[str], tp.List[str]]:
+    """Returns regressed metrics and metrics without baselines"""
+    regressions = []
+    missing = []
+    print(f"{'metric':<50} {'baseline, ms':>13} {'current, ms':>12} change")
+    for name, current in sorted(results.items()):
+        baseline = baselines.get(name)
+        if baseline is None:
+            print(
+                f"{name:<50} {'-':>13} {current * 1000:>12.3f} "
+                "NO BASELINE"
+            )
+            missing.append(name)
+            continue
+        change = (current - baseline) / baseline
+        is_regression = (
+            change > tolerance and current - baseline > MIN_DELTA
+        )
+        mark = "  REGRESSION" if is_regression else ""
+        print(
+            f"{name:<50} {baseline * 1000:>13.3f} {current * 1000:>12.3f} "
+            f"{change:+.0%}{mark}"
+        )
+        if is_regression:
+            regressions.append(name)
+    return regressions, missing
+
+
+def run_round(
+    sizes: tp.Sequence[int],
+    db_url: tp.Optional[str],
+) -> tp.Dict[str, float]:
+    results = bench_handlers.run(sizes)
+    results.update(asyncio.run(bench_router.run()))
+    if db_url:
+        results.update(asyncio.run(bench_db.run(db_url, sizes)))
+    return results
+
+
+def main(argv: tp.Optional[tp.Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m tests.bench")
+    parser.add_argument("--update", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument(
+        "--sizes",
+        type=lambda s: [int(size) for size in s.split(",")],
+        default=DEFAULT_SIZES,
+    )
+    parser.add_argument("--rounds", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    db_url = os.getenv("BENCH_DB_URL")
+    if not db_url:
+        print("BENCH_DB_URL is not set, skipping DB benchmarks")
+    combine = max if args.update else min
+    results: tp.Dict[str, float] = {}
+    for _ in range(args.rounds):
+        round_results = run_round(args.sizes, db_url)
+        for name, value in round_results.items():
+            results[name] = combine(results.get(name, value), value)
+
+    baselines = load_baselines()
+    if args.update:
+        baselines = baselines or {}
+        baselines.update(results)
+        save_baselines(baselines)
+        print(f"Baselines saved to {BASELINES_PATH}")
+        return 0
+    if baselines is None:
+        print(
+            f"{BASELINES_PATH} not found, "
+            "record baselines with --update first"
+        )
+        return 1
+
+    regressions, missing = compare(results, baselines, args.tolerance)
+    is_failed = False
+    if regressions:
+        print(
+            f"{len(regressions)} metrics regressed "
+            f"by more than {args.tolerance:.0%}"
+        )
+        is_failed = True
+    if missing:
+        print(
+            f"{len(missing)} metrics have no baseline, "
+            "record them with --update"
+        )
+        is_failed = True
+    return 1 if is_failed else 0
@@ -0,0 +1,25 @@
+import time
+import timeit
+import typing as tp
+
+
+def get_repeat(size: int) -> int:
+    return 3 if size >= 10 ** 5 else 5
+
+
+def measure(func: tp.Callable[[], tp.Any], size: int) -> float:
+    number = max(1, 10 ** 4 // size)
+    timings = timeit.Timer(func).repeat(get_repeat(size), number)
+    return min(timings) / number
+
+
+async def measure_async(
+    func: tp.Callable[[], tp.Awaitable[tp.Any]],
+    size: int,
+) -> float:
+    timings = []
+    for _ in range(get_repeat(size)):
+        started_at = time.perf_counter()
+        await func()
+        timings.append(time.perf_counter() - started_at)
+    return min(timings)
@@ -0,0 +1,128 @@
+import asyncio
+import typing as tp
+
+import pytest
+from aiogram import types as tt
+
+from monya.catchup import confirm_updates, process_writes
+from monya.db import ChatAlreadyExistsError, UserNotExistsError
+from monya.handlers import get_suggest_index, make_not_written_reply
+from monya.settings import CatchUpConfig
+
+CHAT_ID = -1
+USER_ID = 7
+
+
+class FakeDB:
+    """Fails the first `n_failures` batch writes like unavailable DB"""
+
+    def __init__(self, n_failures: int = 0) -> None:
+        self.t_bot_id = 1
+        self.n_failures = n_failures
+        self.n_calls = 0
+        self.applied: tp.List[int] = []
+
+    async def add_chat(self, t_chat_id: int) -> None:
+        raise ChatAlreadyExistsError
+
+    async def add_operations_batch(
+        self,
+        t_chat_id: int,
+        batch: tp.List[tp.Tuple[int, tp.List]],
+    ) -> tp.List[tp.Optional[UserNotExistsError]]:
+        self.n_calls += 1
+        if self.n_calls <= self.n_failures:
+            raise ConnectionRefusedError
+        errors: tp.List[tp.Optional[UserNotExistsError]] = []
+        for t_message_id, operations in batch:
+            if any(name == "Петя" for name, _, _ in operations):
+                errors.append(UserNotExistsError("Петя"))
+            else:
+                self.applied.append(t_message_id)
+                errors.append(None)
+        return errors
+
+
+class FakeBot:
+    def __init__(self, n_failures: int) -> None:
+        self.n_failures = n_failures
+        self.offsets: tp.List[int] = []
+
+    async def get_updates(self, offset: int, limit: int, timeout: int):
+        self.offsets.append(offset)
+        if len(self.offsets) <= self.n_failures:
+            raise ConnectionResetError
+        return []
+
+
+@pytest.fixture
+def replies(monkeypatch: pytest.MonkeyPatch) -> tp.List[tp.Tuple[int, str]]:
+    """Texts sent by `Message.reply` instead of Telegram"""
+    sent = []
+
+    async def reply(message: tt.Message, text: str) -> None:
+        sent.append((message.message_id, text))
+
+    monkeypatch.setattr(tt.Message, "reply", reply)
+    return sent
+
+
+def make_config(**kwargs: tp.Any) -> CatchUpConfig:
+    config = {
+        "catchup_retry_interval": 0,
+        "catchup_max_attempts": 3,
+        **kwargs,
+    }
+    return CatchUpConfig(**config)
+
+
+def make_message(message_id: int, text: str) -> tt.Message:
+    return tt.Message(
+        message_id=message_id,
+        date=0,
+        chat={"id": CHAT_ID, "type": "group"},
+        text=text,
+        **{"from": {"id": USER_ID, "is_bot": False, "first_name": "Вася"}},
+    )
+
+
+MESSAGES = [
+    make_message(1, "spend Вася 100 такси"),
+    make_message(2, "spend Вася сто"),
+    make_message(3, "pay Петя 50"),
+]
+
+
+def test_writes_are_retried_and_replied_once(
+    replies: tp.List[tp.Tuple[int, str]],
+) -> None:
+    db = FakeDB(n_failures=2)
+    asyncio.run(process_writes(MESSAGES, db, make_config()))
+
+    assert db.n_calls == 3
+    assert db.applied == [1]
+    assert [message_id for message_id, _ in replies] == [2, 1, 3]
+    # Backlog messages are remembered for inline queries like live ones
+    assert get_suggest_index(db).get_user_chat(USER_ID) == CHAT_ID
+
+
+def test_writes_are_dropped_after_max_attempts(
+    replies: tp.List[tp.Tuple[int, str]],
+) -> None:
+    db = FakeDB(n_failures=10)
+    asyncio.run(process_writes(MESSAGES, db, make_config()))
+
+    assert db.n_calls == 3
+    assert not db.applied
+    not_written = [
+        message_id
+        for message_id, text in replies
+        if text == make_not_written_reply()
+    ]
+    assert not_written == [1, 3]
+
+
+def test_confirm_updates_retries_until_success() -> None:
+    bot = FakeBot(n_failures=4)
+    asyncio.run(confirm_updates(bot, 42, make_config()))
+    assert bot.offsets == [42] * 5
@@ -0,0 +1,47 @@
+import pytest
+
+from monya.handlers import OperationParseError, parse_name, parse_operations
+
+
+@pytest.mark.parametrize(
+    "args, name",
+    [
+        ("Вася", "Вася"),
+        ("  Вася_2 ", "Вася_2"),
+        ("", None),
+        ("Вася Пупкин", None),
+        ("Вася!", None),
+    ],
+)
+def test_parse_name(args: str, name: str) -> None:
+    assert parse_name(args) == {"name": name}
+
+
+def test_parse_operations() -> None:
+    text = (
+        "@monya_bot pay Вася 100\n"
+        "  SPEND Петя 20.5 кафе, с чаем  \n"
+        "\n"
+        "spend Маша 3,25"
+    )
+    assert parse_operations(text) == [
+        ("Вася", 100.0, ""),
+        ("Петя", -20.5, "кафе, с чаем"),
+        ("Маша", -3.25, ""),
+    ]
+
+
+@pytest.mark.parametrize(
+    "text, line_no",
+    [
+        ("pay Вася", 1),
+        ("pay Вася 100\nspend Петя 1e5", 2),
+        ("pay Вася 100\n\nspend Петя inf", 3),
+        ("pay Вася -100", 1),
+        ("transfer Вася 100", 1),
+    ],
+)
+def test_parse_operations_error(text: str, line_no: int) -> None:
+    with pytest.raises(OperationParseError) as error:
+        parse_operations(text)
+    assert error.value.line_no == line_no
@@ -0,0 +1,290 @@
+import asyncio
+import typing as tp
+from pathlib import Path
+
+import orjson
+
+from monya.db import UserNotExistsError
+from monya.journal import (
+    CHECKPOINT_FILE,
+    SEGMENT_PREFIX,
+    SEGMENT_SUFFIX,
+    Journal,
+)
+from monya.settings import JournalConfig
+
+T_CHAT_ID = -100
+OPERATIONS = [("Вася", 100.0, "такси"), ("Петя", 50.0, "кафе")]
+
+
+class FakeDB:
+    """Applies batches like `DBService.add_operations_batch`"""
+
+    def __init__(self) -> None:
+        self.applied: tp.Dict[tp.Tuple[int, int], tp.List] = {}
+        self.n_calls = 0
+        self.is_down = False
+        # Number of next calls that are applied, but fail afterwards,
+        # like a connection lost before the commit is acknowledged
+        self.n_lost_acks = 0
+        self.unknown_names: tp.Set[str] = set()
+
+    async def add_operations_batch(
+        self,
+        t_chat_id: int,
+        batch: tp.List[tp.Tuple[int, tp.List]],
+    ) -> tp.List[tp.Optional[Exception]]:
+        self.n_calls += 1
+        if self.is_down:
+            raise ConnectionRefusedError
+        errors: tp.List[tp.Optional[Exception]] = []
+        for t_message_id, operations in batch:
+            missing = {
+                name for name, _, _ in operations
+                if name in self.unknown_names
+            }
+            if missing:
+                errors.append(UserNotExistsError(*sorted(missing)))
+                continue
+            self.applied.setdefault((t_chat_id, t_message_id), operations)
+            errors.append(None)
+        if self.n_lost_acks:
+            self.n_lost_acks -= 1
+            raise ConnectionResetError
+        return errors
+
+
+def make_journal(path: Path, **kwargs: tp.Any) -> Journal:
+    config = {
+        "journal_dir": str(path),
+        "journal_retry_interval": 0.01,
+        **kwargs,
+    }
+    return Journal(JournalConfig(**config))
+
+
+def list_segments(path: Path) -> tp.List[Path]:
+    return sorted(path.glob(f"{SEGMENT_PREFIX}*{SEGMENT_SUFFIX}"))
+
+
+async def wait_replayed(journal: Journal) -> None:
+    for _ in range(100):
+        if not journal.get_pending(T_CHAT_ID):
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("Journal is not replayed")
+
+
+def test_append_is_applied_and_acked(tmp_path: Path) -> None:
+    db = FakeDB()
+
+    async def run() -> None:
+        journal = make_journal(tmp_path)
+        await journal.open(db.add_operations_batch)
+        acks = await asyncio.gather(
+            *(journal.append(T_CHAT_ID, i, OPERATIONS) for i in range(5))
+        )
+        errors = await asyncio.wait_for(asyncio.gather(*acks), 1)
+        await journal.close()
+        assert errors == [None] * 5
+
+    asyncio.run(run())
+    assert sorted(db.applied) == [(T_CHAT_ID, i) for i in range(5)]
+    # Group commit: all messages go to DB with one batch
+    assert db.n_calls <= 2
+
+
+def test_restart_replays_pending(tmp_path: Path) -> None:
+    db = FakeDB()
+    db.is_down = True
+
+    async def run_down() -> None:
+        journal = make_journal(tmp_path)
+        await journal.open(db.add_operations_batch)
+        for i in range(3):
+            await journal.append(T_CHAT_ID, i, OPERATIONS)
+        await asyncio.sleep(0.05)
+        assert len(journal.get_pending(T_CHAT_ID)) == 3
+        await journal.close()
+
+    async def run_up() -> None:
+        journal = make_journal(tmp_path)
+        await journal.open(db.add_operations_batch)
+        await wait_replayed(journal)
+        await journal.close()
+
+    asyncio.run(run_down())
+    assert not db.applied
+    db.is_down = False
+    asyncio.run(run_up())
+    assert sorted(db.applied) == [(T_CHAT_ID, i) for i in range(3)]
+
+
+def test_torn_tail_is_ignored(tmp_path: Path) -> None:
+    db = FakeDB()
+    record = orjson.dumps({"chat": T_CHAT_ID, "msg": 1, "ops": OPERATIONS})
+    torn = orjson.dumps({"chat": T_CHAT_ID, "msg": 2, "ops": OPERATIONS})
+    segment_path = tmp_path / f"{SEGMENT_PREFIX}{0:08d}{SEGMENT_SUFFIX}"
+    data = record + b"\n" + torn[:-5]
+    segment_path.write_bytes(data)
+
+    async def run() -> None:
+        journal = make_journal(tmp_path)
+        await journal.open(db.add_operations_batch)
+        await wait_replayed(journal)
+        ack = await journal.append(T_CHAT_ID, 3, OPERATIONS)
+        assert await asyncio.wait_for(ack, 1) is None
+        await journal.close()
+
+    asyncio.run(run())
+    assert sorted(db.applied) == [(T_CHAT_ID, 1), (T_CHAT_ID, 3)]
+    # New records are never appended after the torn one
+    assert not segment_path.exists() or segment_path.read_bytes() == data
+
+
+def test_checkpoint_removes_applied_segments(tmp_path: Path) -> None:
+    db = FakeDB()
+
+    async def run() -> None:
+        # Every record fills a segment
+        journal = make_journal(tmp_path, journal_segment_max_size=1)
+        await journal.open(db.add_operations_batch)
+        for i in range(5):
+            ack = await journal.append(T_CHAT_ID, i, OPERATIONS)
+            await asyncio.wait_for(ack, 1)
+        await wait_replayed(journal)
+        await journal.close()
+
+    asyncio.run(run())
+    checkpoint = orjson.loads((tmp_path / CHECKPOINT_FILE).read_bytes())
+    segments = list_segments(tmp_path)
+    assert len(segments) <= 2
+    assert all(
+        int(p.name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+        >= checkpoint["segment"]
+        for p in segments
+    )
+
+    # Nothing is replayed after restart
+    n_calls = db.n_calls
+    asyncio.run(run_reopen(tmp_path, db))
+    assert db.n_calls == n_calls
+
+
+async def run_reopen(path: Path, db: FakeDB) -> None:
+    journal = make_journal(path)
+    await journal.open(db.add_operations_batch)
+    assert not journal.get_pending(T_CHAT_ID)
+    await journal.close()
+
+
+def test_checkpoint_advances_before_queue_is_drained(tmp_path: Path) -> None:
+    db = FakeDB()
+    db.is_down = True
+    # (pending entries, segments) seen by every batch after DB is up
+    seen: tp.List[tp.Tuple[int, int]] = []
+
+    async def run() -> None:
+        journal = make_journal(
+            tmp_path,
+            journal_segment_max_size=1,
+            journal_replay_batch_size=2,
+            journal_retry_interval=0.05,
+        )
+
+        async def apply(
+            t_chat_id: int,
+            batch: tp.List[tp.Tuple[int, tp.List]],
+        ) -> tp.List[tp.Optional[Exception]]:
+            if not db.is_down:
+                seen.append(
+                    (
+                        len(journal.get_pending(T_CHAT_ID)),
+                        len(list_segments(tmp_path)),
+                    )
+                )
+            return await db.add_operations_batch(t_chat_id, batch)
+
+        await journal.open(apply)
+        for i in range(10):
+            await journal.append(T_CHAT_ID, i, OPERATIONS)
+        db.is_down = False
+        await wait_replayed(journal)
+        await journal.close()
+
+    asyncio.run(run())
+    assert len(db.applied) == 10
+    assert [n_pending for n_pending, _ in seen] == [10, 8, 6, 4, 2]
+    # Segments of applied batches are removed while entries are pending
+    n_segments = [n for _, n in seen]
+    assert n_segments == sorted(n_segments, reverse=True)
+    assert n_segments[-1] < n_segments[0]
+
+
+def test_replay_is_idempotent(tmp_path: Path) -> None:
+    db = FakeDB()
+    db.n_lost_acks = 2
+
+    async def run() -> None:
+        journal = make_journal(tmp_path)
+        await journal.open(db.add_operations_batch)
+        ack = await journal.append(T_CHAT_ID, 1, OPERATIONS)
+        assert await asyncio.wait_for(ack, 1) is None
+        await journal.close()
+
+    asyncio.run(run())
+    # Applied three times, but stored once
+    assert db.n_calls == 3
+    assert db.applied == {(T_CHAT_ID, 1): OPERATIONS}
+
+
+def test_unknown_users_are_dropped(tmp_path: Path) -> None:
+    db = FakeDB()
+    db.unknown_names = {"Петя"}
+
+    async def run() -> None:
+        journal = make_journal(tmp_path)
+        await journal.open(db.add_operations_batch)
+        bad_ack = await journal.append(T_CHAT_ID, 1, OPERATIONS)
+        good_ack = await journal.append(T_CHAT_ID, 2, OPERATIONS[:1])
+        error = await asyncio.wait_for(bad_ack, 1)
+        assert isinstance(error, UserNotExistsError)
+        assert error.args == ("Петя",)
+        assert await asyncio.wait_for(good_ack, 1) is None
+        await wait_replayed(journal)
+        await journal.close()
+
+    asyncio.run(run())
+    assert list(db.applied) == [(T_CHAT_ID, 2)]
+
+
+def test_released_rejections_are_reported(tmp_path: Path) -> None:
+    db = FakeDB()
+    db.is_down = True
+    db.unknown_names = {"Петя"}
+    rejected: tp.List[tp.Tuple[int, int, tp.Tuple]] = []
+
+    async def on_rejected(
+        t_chat_id: int,
+        t_message_id: int,
+        error: UserNotExistsError,
+    ) -> None:
+        rejected.append((t_chat_id, t_message_id, error.args))
+
+    async def run() -> None:
+        journal = make_journal(tmp_path)
+        await journal.open(db.add_operations_batch, on_rejected)
+        waited_ack = await journal.append(T_CHAT_ID, 1, OPERATIONS)
+        await journal.append(T_CHAT_ID, 2, OPERATIONS)
+        # Nobody waits for the second message any more
+        journal.release(T_CHAT_ID, 2)
+        db.is_down = False
+        assert isinstance(
+            await asyncio.wait_for(waited_ack, 1),
+            UserNotExistsError,
+        )
+        await wait_replayed(journal)
+        await journal.close()
+
+    asyncio.run(run())
+    assert rejected == [(T_CHAT_ID, 2, ("Петя",))]
@@ -0,0 +1,214 @@
+import asyncio
+import typing as tp
+
+import pytest
+from aiogram import types as tt
+from aiogram.dispatcher.handler import CancelHandler
+
+from monya import middlewares
+from monya.middlewares import (
+    FLOOD_NOTICE,
+    FloodControlMiddleware,
+    TokenBuckets,
+    UpdateStatsMiddleware,
+)
+from monya.settings import FloodConfig
+
+CHAT_ID = -1
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> FakeClock:
+    clock = FakeClock()
+    monkeypatch.setattr(middlewares, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def notices(monkeypatch: pytest.MonkeyPatch) -> tp.List[tp.Tuple[int, str]]:
+    """Texts sent by `Message.answer` instead of Telegram"""
+    sent = []
+
+    async def answer(message: tt.Message, text: str) -> None:
+        sent.append((message.chat.id, text))
+
+    monkeypatch.setattr(tt.Message, "answer", answer)
+    return sent
+
+
+def make_config(**kwargs: tp.Any) -> FloodConfig:
+    config = {
+        "flood_chat_rate": 1,
+        "flood_chat_burst": 5,
+        "flood_user_rate": 1,
+        "flood_user_burst": 2,
+        "flood_query_rate": 1,
+        "flood_query_burst": 3,
+        "flood_notice_window": 60,
+        **kwargs,
+    }
+    return FloodConfig(**config)
+
+
+def make_message_update(
+    user_id: int,
+    chat_id: int = CHAT_ID,
+) -> tt.Update:
+    return tt.Update(
+        update_id=1,
+        message={
+            "message_id": 1,
+            "date": 0,
+            "chat": {"id": chat_id, "type": "group"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Вася"},
+            "text": "/status",
+        },
+    )
+
+
+def make_inline_update(user_id: int) -> tt.Update:
+    return tt.Update(
+        update_id=1,
+        inline_query={
+            "id": "1",
+            "from": {"id": user_id, "is_bot": False, "first_name": "Вася"},
+            "query": "pay",
+            "offset": "",
+        },
+    )
+
+
+def process(
+    middleware: FloodControlMiddleware,
+    updates: tp.Sequence[tt.Update],
+) -> tp.List[bool]:
+    """Returns if each update is passed to handlers"""
+
+    async def run() -> tp.List[bool]:
+        passed = []
+        for update in updates:
+            try:
+                await middleware.on_pre_process_update(update, {})
+            except CancelHandler:
+                passed.append(False)
+            else:
+                passed.append(True)
+        return passed
+
+    return asyncio.run(run())
+
+
+def test_burst_then_rate() -> None:
+    buckets = TokenBuckets(rate=2, burst=3, max_size=10)
+    assert [buckets.take(1, now=0) for _ in range(4)] == [
+        True, True, True, False,
+    ]
+    # 2 tokens per second
+    assert buckets.take(1, now=0.25) is False
+    assert buckets.take(1, now=0.5) is True
+    assert buckets.take(1, now=0.5) is False
+
+
+def test_tokens_are_capped_by_burst() -> None:
+    buckets = TokenBuckets(rate=1, burst=2, max_size=10)
+    assert buckets.take(1, now=0)
+    assert [buckets.take(1, now=100) for _ in range(3)] == [
+        True, True, False,
+    ]
+
+
+def test_keys_are_independent() -> None:
+    buckets = TokenBuckets(rate=1, burst=1, max_size=10)
+    assert buckets.take(1, now=0)
+    assert not buckets.take(1, now=0)
+    assert buckets.take(2, now=0)
+
+
+def test_least_recently_used_are_evicted() -> None:
+    buckets = TokenBuckets(rate=1, burst=1, max_size=2)
+    buckets.take(1, now=0)
+    buckets.take(2, now=0)
+    # 1 becomes the most recently used, 2 is evicted
+    buckets.take(1, now=0)
+    buckets.take(3, now=0)
+    assert len(buckets) == 2
+    # Evicted key starts with a full bucket again
+    assert buckets.take(2, now=0)
+    assert not buckets.take(3, now=0)
+
+
+def test_user_flood_is_dropped_with_one_notice(
+    clock: FakeClock,
+    notices: tp.List[tp.Tuple[int, str]],
+) -> None:
+    stats = UpdateStatsMiddleware()
+    middleware = FloodControlMiddleware(make_config(), stats)
+    updates = [make_message_update(user_id=1) for _ in range(5)]
+    assert process(middleware, updates) == [True, True, False, False, False]
+    assert stats.get_stats()["n_dropped_by_reason"] == {"user": 3}
+    assert notices == [(CHAT_ID, FLOOD_NOTICE)]
+
+    # Tokens are back, but the next drop is still in the notice window
+    clock.now += 30
+    assert process(middleware, updates) == [True, True, False, False, False]
+    assert len(notices) == 1
+
+    clock.now += 31
+    process(middleware, updates)
+    assert len(notices) == 2
+    assert stats.get_stats()["n_dropped"] == 9
+
+
+def test_chat_flood_is_dropped(
+    clock: FakeClock,
+    notices: tp.List[tp.Tuple[int, str]],
+) -> None:
+    stats = UpdateStatsMiddleware()
+    middleware = FloodControlMiddleware(make_config(), stats)
+    updates = [make_message_update(user_id=i) for i in range(7)]
+    assert process(middleware, updates) == [True] * 5 + [False] * 2
+    assert stats.get_stats()["n_dropped_by_reason"] == {"chat": 2}
+    assert notices == [(CHAT_ID, FLOOD_NOTICE)]
+    # Other chats are not affected
+    assert process(middleware, [make_message_update(1, chat_id=-2)]) == [
+        True,
+    ]
+
+
+def test_queries_do_not_use_message_budget(
+    clock: FakeClock,
+    notices: tp.List[tp.Tuple[int, str]],
+) -> None:
+    stats = UpdateStatsMiddleware()
+    middleware = FloodControlMiddleware(make_config(), stats)
+    queries = [make_inline_update(user_id=1) for _ in range(4)]
+    assert process(middleware, queries) == [True, True, True, False]
+    assert process(middleware, [make_message_update(user_id=1)]) == [True]
+    assert stats.get_stats()["n_dropped_by_reason"] == {"query": 1}
+    # Nowhere to send a notice to
+    assert not notices
+
+
+def test_buckets_and_notices_are_bounded(
+    clock: FakeClock,
+    notices: tp.List[tp.Tuple[int, str]],
+) -> None:
+    stats = UpdateStatsMiddleware()
+    middleware = FloodControlMiddleware(
+        make_config(flood_max_buckets=2, flood_user_burst=1),
+        stats,
+    )
+    for chat_id in range(-1, -6, -1):
+        process(middleware, [make_message_update(-chat_id, chat_id)] * 2)
+    assert len(middleware._users) == 2
+    assert len(middleware._chats) == 2
+    assert len(middleware._noticed) == 2
+    assert len(notices) == 5
@@ -0,0 +1,111 @@
+import asyncio
+import typing as tp
+
+import pytest
+
+from monya.pool import PoolManager, PoolStats
+from monya.settings import PoolManagerConfig
+
+MAX_SIZE = 10
+
+
+class FakeAcquireContext:
+    def __init__(self, pool: "FakePool") -> None:
+        self.pool = pool
+
+    async def __aenter__(self) -> None:
+        self.pool.n_held += 1
+        self.pool.max_held = max(self.pool.max_held, self.pool.n_held)
+        await asyncio.sleep(0)
+
+    async def __aexit__(self, *exc_info: tp.Any) -> None:
+        self.pool.n_held -= 1
+
+
+class FakePool:
+    def __init__(self) -> None:
+        self.stats = PoolStats(wait_threshold=0.05)
+        self.n_held = 0
+        self.max_held = 0
+
+    def acquire_untracked(
+        self,
+        *,
+        timeout: tp.Optional[float] = None,
+    ) -> FakeAcquireContext:
+        return FakeAcquireContext(self)
+
+
+def make_manager(floor: int, **config: tp.Any) -> PoolManager:
+    config = {"pool_floor_min": 1, "pool_shrink_windows": 3, **config}
+    # Not validated: the pool is a fake
+    return PoolManager.construct(
+        pool=FakePool(),
+        max_size=MAX_SIZE,
+        config=PoolManagerConfig(**config),
+        floor=floor,
+    )
+
+
+def test_floor_grows_at_once() -> None:
+    manager = make_manager(floor=2)
+    assert manager._next_floor(5) == 5
+
+
+def test_floor_is_capped() -> None:
+    manager = make_manager(floor=2, pool_floor_min=3)
+    assert manager._next_floor(MAX_SIZE + 5) == MAX_SIZE
+    assert make_manager(floor=5, pool_floor_min=3)._next_floor(0) == 5
+
+
+def test_floor_shrinks_after_low_windows() -> None:
+    manager = make_manager(floor=8)
+    floors = []
+    for _ in range(3):
+        manager.floor = manager._next_floor(1)
+        floors.append(manager.floor)
+    # At most by half, after `pool_shrink_windows` low windows in a row
+    assert floors == [8, 8, 4]
+
+
+def test_high_window_resets_shrinking() -> None:
+    manager = make_manager(floor=8)
+    for peak in (1, 1, 8, 1, 1):
+        manager.floor = manager._next_floor(peak)
+    assert manager.floor == 8
+    manager.floor = manager._next_floor(1)
+    assert manager.floor == 4
+
+
+def test_floor_does_not_shrink_below_floor_min() -> None:
+    manager = make_manager(floor=4, pool_floor_min=3)
+    for _ in range(3):
+        manager.floor = manager._next_floor(0)
+    assert manager.floor == 3
+
+
+@pytest.mark.parametrize(
+    "floor, in_use, warm_up_size",
+    [
+        (3, 0, 3),
+        (3, 2, 1),
+        (3, 5, 0),
+        # Half of free connections at most
+        (MAX_SIZE, 0, 5),
+        (MAX_SIZE, 6, 2),
+        # The last free connection is never taken
+        (MAX_SIZE, 8, 1),
+        (MAX_SIZE, 9, 0),
+    ],
+)
+def test_warm_up_size(floor: int, in_use: int, warm_up_size: int) -> None:
+    manager = make_manager(floor=floor)
+    manager.pool.stats.in_use = in_use
+    assert manager._get_warm_up_size() == warm_up_size
+
+
+def test_warm_up_leaves_free_connections() -> None:
+    manager = make_manager(floor=MAX_SIZE, pool_warm_up_share=1)
+    asyncio.run(manager._warm_up())
+    assert manager.pool.max_held == MAX_SIZE - 1
+    assert manager.pool.n_held == 0
@@ -0,0 +1,75 @@
+import typing as tp
+
+import pytest
+from aiogram import types as tt
+
+from monya import handlers
+from monya.handlers import make_router
+
+BOT_NAME = "monya_bot"
+
+
+def make_message(text: str) -> tt.Message:
+    return tt.Message(
+        message_id=1,
+        date=0,
+        chat={"id": -1, "type": "group"},
+        text=text,
+    )
+
+
+def route(text: str) -> tp.Optional[tp.Tuple[tp.Any, tp.Dict[str, tp.Any]]]:
+    router = make_router(BOT_NAME, scheduler=None, offloader=None)
+    return router.route(make_message(text))
+
+
+@pytest.mark.parametrize("text", ["/add Вася", f"/add@{BOT_NAME} Вася"])
+def test_command(text: str) -> None:
+    assert route(text) == (handlers.add_user_h, {"name": "Вася"})
+
+
+def test_command_is_case_insensitive() -> None:
+    assert route(f"/USERS@{BOT_NAME.upper()}") == (handlers.get_users_h, {})
+
+
+def test_command_of_other_bot_is_ignored() -> None:
+    assert route("/add@other_bot Вася") is None
+
+
+def test_unknown_command_is_ignored() -> None:
+    assert route("/unknown") is None
+
+
+def test_multiline_operations() -> None:
+    text = (
+        f"@{BOT_NAME} pay Вася 1500 продукты #еда\n"
+        "\n"
+        "spend Петя 350,5 такси"
+    )
+    handler, kwargs = route(text)
+    assert handler is handlers.spend_pay_msg_h
+    assert kwargs == {
+        "operations": [
+            ("Вася", 1500.0, "продукты #еда"),
+            ("Петя", -350.5, "такси"),
+        ],
+        "parse_error": None,
+    }
+
+
+def test_operations_with_bad_line() -> None:
+    handler, kwargs = route(f"@{BOT_NAME} pay Вася 100\nspend Петя много")
+    assert handler is handlers.spend_pay_msg_h
+    assert kwargs["operations"] == []
+    assert kwargs["parse_error"].line_no == 2
+    assert kwargs["parse_error"].line == "spend Петя много"
+
+
+def test_mention_fallback() -> None:
+    text = f"@{BOT_NAME.upper()} как дела?"
+    assert route(text) == (handlers.other_msg_h, {})
+
+
+def test_other_messages_are_ignored() -> None:
+    assert route("просто болтовня в чате") is None
+    assert route("@other_bot pay Вася 100") is None
@@ -0,0 +1,63 @@
+import asyncio
+import typing as tp
+from uuid import UUID, uuid4
+
+from monya.scheduler import Scheduler
+from monya.settings import SchedulerConfig
+
+
+class FakeDB:
+    """Schedules with missed runs, like after a long downtime"""
+
+    def __init__(self, n_schedules: int) -> None:
+        # schedule_id -> n_runs
+        self.schedules = {uuid4(): 0 for _ in range(n_schedules)}
+        self.n_refills = 0
+
+    async def get_upcoming_schedules(
+        self,
+        horizon: float,
+        limit: int,
+    ) -> tp.List[tp.Tuple[UUID, int, float]]:
+        self.n_refills += 1
+        due = [
+            (schedule_id, n_runs, -1.0)
+            for schedule_id, n_runs in self.schedules.items()
+            if n_runs == 0
+        ]
+        return due[:limit]
+
+    async def run_schedules(
+        self,
+        runs: tp.Sequence[tp.Tuple[UUID, int]],
+    ) -> tp.List[tp.Tuple[UUID, int, float]]:
+        done = []
+        for schedule_id, n_runs in runs:
+            if self.schedules[schedule_id] == n_runs:
+                self.schedules[schedule_id] = n_runs + 1
+                # Next run is a day later
+                done.append((schedule_id, n_runs + 1, 86400.0))
+        return done
+
+
+def test_missed_runs_above_max_loaded_are_recovered() -> None:
+    db = FakeDB(25)
+    config = SchedulerConfig(
+        scheduler_horizon=600,
+        scheduler_batch_size=4,
+        scheduler_max_loaded=10,
+    )
+
+    async def run() -> None:
+        scheduler = Scheduler(db, config)
+        await scheduler.setup()
+        for _ in range(100):
+            if all(n_runs == 1 for n_runs in db.schedules.values()):
+                break
+            await asyncio.sleep(0.01)
+        await scheduler.cleanup()
+
+    asyncio.run(run())
+    # Not one refill per half of the horizon, but one per 10 runs
+    assert all(n_runs == 1 for n_runs in db.schedules.values())
+    assert db.n_refills == 3
@@ -0,0 +1,176 @@
+import asyncio
+import typing as tp
+
+import pytest
+
+from monya import suggest
+from monya.handlers import OPERATION_RE
+from monya.suggest import (
+    ChatSuggestions,
+    SuggestIndex,
+    make_inline_entries,
+    parse_amount,
+)
+
+NAMES = ["Маша", "Вася", "Марк", "петя"]
+# Newest first, like `DBService.get_recent_operations`
+RECENT = [
+    ("Вася", -350.5, "такси"),
+    ("Вася", 1500, "продукты"),
+    ("Маша", -200, "такси"),
+    ("Маша", -100, "кафе"),
+]
+
+
+def make_chat() -> ChatSuggestions:
+    return ChatSuggestions(NAMES, RECENT)
+
+
+@pytest.mark.parametrize(
+    "prefix, names",
+    [
+        ("", ["Вася", "Марк", "Маша", "петя"]),
+        ("ма", ["Марк", "Маша"]),
+        ("МАШ", ["Маша"]),
+        ("П", ["петя"]),
+        ("Коля", []),
+    ],
+)
+def test_match_names(prefix: str, names: tp.List[str]) -> None:
+    assert make_chat().match_names(prefix) == names
+
+
+def test_names_are_added_and_removed() -> None:
+    chat = make_chat()
+    chat.add_name("Мадина")
+    assert chat.match_names("Ма") == ["Мадина", "Марк", "Маша"]
+    chat.remove_name("Маша")
+    assert chat.match_names("Ма") == ["Мадина", "Марк"]
+    assert chat.get_recent("Маша") == []
+
+
+def test_match_comments_most_used_first() -> None:
+    chat = make_chat()
+    chat.add_operations([("Петя", -10, "кафе"), ("Петя", -10, "кафе")])
+    assert chat.match_comments("", 10) == ["кафе", "такси", "продукты"]
+    assert chat.match_comments("Т", 10) == ["такси"]
+    assert chat.match_comments("", 1) == ["кафе"]
+
+
+def test_recent_operations_are_bounded() -> None:
+    chat = make_chat()
+    chat.add_operations(
+        [("Вася", -i, "") for i in range(1, suggest.RECENT_PER_NAME + 2)]
+    )
+    recent = chat.get_recent("Вася")
+    assert len(recent) == suggest.RECENT_PER_NAME
+    assert recent[0] == (-(suggest.RECENT_PER_NAME + 1), "")
+
+
+@pytest.mark.parametrize(
+    "query, entries",
+    [
+        (
+            "spend Ма",
+            ["spend Маша 200 такси", "spend Маша 100 кафе"],
+        ),
+        ("pay ва", ["pay Вася 1500 продукты"]),
+        (
+            "s Вася",
+            ["spend Вася 350.5 такси"],
+        ),
+        # Names without operations have nothing ready to send
+        ("pay Марк", []),
+        ("pay Маша", []),
+    ],
+)
+def test_entries_without_amount(query: str, entries: tp.List[str]) -> None:
+    assert make_inline_entries(make_chat(), query) == entries
+
+
+@pytest.mark.parametrize(
+    "query, entries",
+    [
+        # Comments of the whole chat, the most used first
+        (
+            "spend Маша 300",
+            [
+                "spend Маша 300",
+                "spend Маша 300 такси",
+                "spend Маша 300 кафе",
+                "spend Маша 300 продукты",
+            ],
+        ),
+        ("spend Маша 300 к", ["spend Маша 300 к", "spend Маша 300 кафе"]),
+        ("pay Маша 2,5 такси", ["pay Маша 2,5 такси"]),
+        # A typed prefix is completed to names, those without history too
+        ("pay Ма 100 х", ["pay Марк 100 х", "pay Маша 100 х"]),
+        ("pay Коля 100", []),
+    ],
+)
+def test_entries_with_amount(query: str, entries: tp.List[str]) -> None:
+    assert make_inline_entries(make_chat(), query) == entries
+
+
+@pytest.mark.parametrize("amount", ["0", "1e5", "inf", "-5", "1.", "abc"])
+def test_bad_amount_gives_no_entries(amount: str) -> None:
+    assert parse_amount(amount) is None
+    assert make_inline_entries(make_chat(), f"pay Маша {amount}") == []
+
+
+@pytest.mark.parametrize(
+    "query",
+    ["", "p", "spend", "spend Ма", "pay Ма 100", "spend Вася 1,5 т"],
+)
+def test_entries_are_valid_operations(query: str) -> None:
+    entries = make_inline_entries(make_chat(), query)
+    assert len(entries) <= suggest.MAX_ENTRIES
+    assert all(OPERATION_RE.match(entry) for entry in entries)
+
+
+class FakeDB:
+    def __init__(self) -> None:
+        self.n_loads = 0
+
+    async def get_chat_users(self, t_chat_id: int) -> tp.List[str]:
+        self.n_loads += 1
+        return NAMES
+
+    async def get_recent_operations(
+        self,
+        t_chat_id: int,
+        limit: int,
+    ) -> tp.List[tp.Tuple[str, float, str]]:
+        return RECENT
+
+
+def test_index_keeps_least_recently_used_chats(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(suggest, "MAX_CHATS", 2)
+    index = SuggestIndex()
+    db = FakeDB()
+
+    async def run() -> None:
+        for t_chat_id in (1, 2, 1, 3):
+            await index.get_chat(t_chat_id, db)
+
+    asyncio.run(run())
+    assert db.n_loads == 3
+    assert index.get_loaded(1) is not None
+    assert index.get_loaded(2) is None
+    assert index.get_loaded(3) is not None
+
+
+def test_index_keeps_least_recently_used_users(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(suggest, "MAX_USERS", 2)
+    index = SuggestIndex()
+    index.remember_user_chat(1, -1)
+    index.remember_user_chat(2, -2)
+    index.remember_user_chat(1, -3)
+    index.remember_user_chat(3, -3)
+    assert index.get_user_chat(1) == -3
+    assert index.get_user_chat(2) is None
+    assert index.get_user_chat(3) == -3